@@ -0,0 +1,308 @@
+import argparse
+import time
+
+import numpy as np
+
+from solution_file import pack_state
+from vacuum import (DYNAMICS, GOAL_VALUE, MAX_CELLS, MDP, VACUUM_DYNAMICS, SweepStats, read_grid_from_file,
+                    transition_outcomes)
+
+
+class ApproximateMDP:
+    """
+    Approximate solver for grids whose ``m*n*2**(m*n)`` states cannot be
+    enumerated, e.g. 8x8 rooms. The value of a non-goal state is a linear
+    function of features of the robot position and the dirt mask, fitted by
+    value iteration over a fixed sample of states: every sweep backs up the
+    samples through the same transition and reward rules as vacuum.MDP and
+    refits the weights by least squares. Goal states keep their exact value.
+
+    Nothing grows with the state space: memory is the sample, its expected
+    successor features per action and the fitting matrix, and it is checked
+    against ``max_bytes`` before anything is allocated.
+    """
+
+    def __init__(self, _grids, dynamics=VACUUM_DYNAMICS, samples=10000, max_bytes=1 << 28, seed=0):
+        """
+        :param _grids: List of Lists, the grid configuration.
+        :param dynamics: vacuum.Dynamics, the action set and transition/reward rules.
+        :param samples: Integer, number of sampled states the weights are fitted on.
+        :param max_bytes: Integer, memory ceiling of the sample and fitting arrays.
+        :param seed: Integer, seed of the state sampler.
+        """
+        self._grids = _grids
+        self._m = len(_grids)
+        self._n = len(_grids[0])
+        self._cells = self._m * self._n
+        if self._cells > MAX_CELLS:
+            raise ValueError(f"Grids of up to {MAX_CELLS} cells are supported, got {self._cells}")
+        self.dynamics = dynamics
+        self._actions = list(dynamics.actions)
+        self.gamma = 0.90
+        self.theta = 1e-3
+        # Ridge term of the least squares fit, keeping unused features at 0
+        self.regularization = 1e-6
+        self.samples = samples
+        self.max_bytes = max_bytes
+        self.seed = seed
+        self.weights = None
+        self.backups = 0
+        # Optional function called with a vacuum.SweepStats after every sweep
+        self.callback = None
+        self.stop_reason = None
+
+        rows, columns = np.divmod(np.arange(self._cells), self._n)
+        # Manhattan distance from every robot position to every cell
+        self._distances = np.abs(rows[:, None] - rows) + np.abs(columns[:, None] - columns)
+        self._shifts = np.arange(self._cells - 1, -1, -1).astype(np.uint64)
+
+    @property
+    def feature_num(self):
+        return 4 * self._cells + 5
+
+    @property
+    def actions(self):
+        return list(self._actions)
+
+    def nbytes(self, samples=None):
+        """
+        :param samples: Optional integer, number of samples, default ``samples``.
+        :return: Integer, bytes of the arrays :meth:`solve` allocates.
+        """
+        samples = self.samples if samples is None else samples
+        # Sample features, expected successor features per action, the fitting
+        # matrix and two blocks of successor features while they are summed,
+        # plus the per-action constants and the sample itself
+        return 8 * samples * ((len(self._actions) + 4) * self.feature_num + len(self._actions) + 2)
+
+    def features(self, pos, mask):
+        """
+        :param pos: Array of robot positions ``i * n + j``.
+        :param mask: Array of uint64 dirt masks, bit ``m*n - 1 - k`` set when cell ``k`` is dirty.
+        :return: Array of shape (len(pos), feature_num): a bias, the dirt of
+            every cell, the robot position, the dirt of every cell scaled by its
+            distance from the robot, the number of dirty cells, whether the
+            robot's cell is dirty, and the distance to the nearest dirty cell
+            and its discount.
+        """
+        dirty = ((mask[:, None] >> self._shifts) & np.uint64(1)).astype(np.float64)
+        distances = self._distances[pos]
+        count = dirty.sum(axis=1).astype(np.int64)
+        nearest = np.where(dirty > 0, distances, self._m + self._n).min(axis=1)
+        nearest = np.where(count > 0, nearest, 0)
+        features = np.zeros((len(pos), self.feature_num))
+        features[:, 0] = 1
+        features[:, 1:1 + self._cells] = dirty
+        features[np.arange(len(pos)), 1 + self._cells + pos] = 1
+        features[:, 1 + 2 * self._cells:1 + 3 * self._cells] = dirty * distances / (self._m + self._n)
+        features[np.arange(len(pos)), 1 + 3 * self._cells + count] = 1
+        features[:, -3] = dirty[np.arange(len(pos)), pos]
+        features[:, -2] = self.gamma ** nearest
+        features[:, -1] = nearest / (self._m + self._n)
+        return features
+
+    def _expected_successors(self, pos, mask):
+        """
+        Expected successor features and constant terms of every action, with
+        outcomes that stay in the state itself solved in closed form: an action
+        that stays with probability ``q`` is worth
+        ``(r + gamma * sum of the other outcomes' values) / (1 - gamma * q)``,
+        the value of repeating it until it leaves, so an approximate value never
+        props up its own state.
+
+        :return: Tuple of (array of shape (len(pos), actions, features) with the
+            weighted features of the outcomes that leave the state for a
+            non-goal state, array of shape (len(pos), actions) with the rest:
+            expected rewards and the discounted value of goal outcomes).
+        """
+        successors = np.zeros((len(pos), len(self._actions), self.feature_num))
+        constants = np.zeros((len(pos), len(self._actions)))
+        for code, action in enumerate(self._actions):
+            next_pos, next_mask, probs, rewards = transition_outcomes(self._grids, self.dynamics, pos, mask, action)
+            stay = (next_pos == pos[:, None]) & (next_mask == mask[:, None])
+            scale = 1 / (1 - self.gamma * np.where(stay, probs, 0).sum(axis=1))
+            constants[:, code] = (probs * rewards).sum(axis=1)
+            for outcome in range(next_pos.shape[1]):
+                goal = next_mask[:, outcome] == 0
+                constants[:, code] += np.where(goal, probs[:, outcome] * self.gamma * GOAL_VALUE, 0)
+                weight = np.where(goal | stay[:, outcome], 0, probs[:, outcome])
+                successors[:, code] += weight[:, None] * self.features(next_pos[:, outcome], next_mask[:, outcome])
+            constants[:, code] *= scale
+            successors[:, code] *= scale[:, None]
+        return successors, constants
+
+    def sample_states(self, samples):
+        """
+        Draw non-goal states with the robot anywhere and every number of dirty
+        cells about equally likely.
+
+        :param samples: Integer, number of states.
+        :return: Tuple of (array of positions, array of uint64 dirt masks).
+        """
+        rng = np.random.default_rng(self.seed)
+        pos = rng.integers(self._cells, size=samples)
+        density = rng.random(samples)
+        dirty = rng.random((samples, self._cells)) < density[:, None]
+        # A sample without dirt would be a goal state, so give it one dirty cell
+        empty = ~dirty.any(axis=1)
+        dirty[np.flatnonzero(empty), rng.integers(self._cells, size=int(empty.sum()))] = True
+        mask = (dirty.astype(np.uint64) << self._shifts).sum(axis=1, dtype=np.uint64)
+        return pos, mask
+
+    def solve(self, max_sweeps=500):
+        """
+        Fitted value iteration over the sampled states.
+
+        :param max_sweeps: Integer, most sweeps before giving up on ``theta``.
+        :return: Tuple of (weight array, iteration count).
+        """
+        if self.nbytes() > self.max_bytes:
+            raise MemoryError(f"{self.samples} samples need {self.nbytes() / 2 ** 20:.1f} MB, over the "
+                              f"{self.max_bytes / 2 ** 20:.1f} MB ceiling; lower samples or raise max_bytes")
+        pos, mask = self.sample_states(self.samples)
+        features = self.features(pos, mask)
+        successors, constants = self._expected_successors(pos, mask)
+        successors = successors.reshape(-1, self.feature_num)
+        gram = features.T @ features + self.regularization * np.eye(self.feature_num)
+        fit = np.linalg.solve(gram, features.T)
+
+        self.weights = np.zeros(self.feature_num)
+        values = np.zeros(self.samples)
+        policy = np.full(self.samples, -1)
+        iteration_number = 0
+        self.backups = 0
+        self.stop_reason = None
+        while self.stop_reason is None:
+            start_time = time.perf_counter()
+            q = constants + self.gamma * (successors @ self.weights).reshape(self.samples, len(self._actions))
+            self.weights = fit @ q.max(axis=1)
+            new_values = features @ self.weights
+            delta = np.abs(new_values - values).max()
+            values = new_values
+            new_policy = q.argmax(axis=1)
+            policy_changes = int((new_policy != policy).sum())
+            policy = new_policy
+            iteration_number += 1
+            self.backups += self.samples
+            if self.callback is not None:
+                self.callback(SweepStats(iteration_number, float(delta), time.perf_counter() - start_time,
+                                         self.samples, policy_changes))
+            if delta < self.theta:
+                self.stop_reason = 'theta'
+            elif iteration_number >= max_sweeps:
+                self.stop_reason = 'max_sweeps'
+        return self.weights, iteration_number
+
+    def _arrays(self, states):
+        pos, mask = zip(*(divmod(pack_state(state, self._n, self._cells), 1 << self._cells) for state in states))
+        return np.array(pos, dtype=np.int64), np.array(mask, dtype=np.uint64)
+
+    def values(self, pos, mask):
+        """
+        :param pos: Array of robot positions.
+        :param mask: Array of uint64 dirt masks.
+        :return: Array of approximate values, exact for goal states.
+        """
+        return np.where(mask == 0, float(GOAL_VALUE), self.features(pos, mask) @ self.weights)
+
+    def q_values(self, pos, mask):
+        """
+        One-step lookahead through the transition and reward rules on top of
+        the approximate values, with staying put solved in closed form as in
+        fitting.
+
+        :return: Array of shape (actions, len(pos)).
+        """
+        successors, constants = self._expected_successors(pos, mask)
+        return (constants + self.gamma * successors @ self.weights).T
+
+    def greedy_policy(self, pos, mask):
+        """
+        :return: Array of action codes, -1 for goal states.
+        """
+        return np.where(mask == 0, -1, self.q_values(pos, mask).argmax(axis=0))
+
+    def value(self, state):
+        """
+        :param state: Tuple, (i, j, sequence of 'c'/'d').
+        :return: Float, the approximate value of ``state``.
+        """
+        return float(self.values(*self._arrays([state]))[0])
+
+    def act(self, state):
+        """
+        :param state: Tuple, (i, j, sequence of 'c'/'d').
+        :return: String, the greedy action, or None for a goal state.
+        """
+        code = int(self.greedy_policy(*self._arrays([state]))[0])
+        return None if code < 0 else self._actions[code]
+
+    def gap(self, mdp=None, chunk_size=1 << 16):
+        """
+        Compare with the exact solution on a grid small enough for vacuum.MDP.
+
+        :param mdp: Optional vacuum.MDP of the same grid and dynamics covering
+            every state, solved with :meth:`vacuum.MDP.solve`; built and solved
+            here when None.
+        :param chunk_size: Integer, number of states compared at once.
+        :return: Dict with the largest error of the approximate values
+            ('value_error'), the largest and mean loss of following the greedy
+            policy instead of the exact one ('policy_loss', 'mean_policy_loss')
+            and the share of non-goal states where both pick the same action
+            ('agreement').
+        """
+        if mdp is None:
+            mdp = MDP(self._grids, dynamics=self.dynamics)
+            mdp.gamma = self.gamma
+            mdp.solve()
+        exact_values = mdp.V.astype(np.float64)
+        exact_policy = np.where(mdp.model.goal, -1, mdp.model.q_values(exact_values, mdp.gamma).argmax(axis=0))
+        values = np.empty(mdp.state_num)
+        policy = np.empty(mdp.state_num, dtype=np.int8)
+        for start in range(0, mdp.state_num, chunk_size):
+            stop = min(start + chunk_size, mdp.state_num)
+            pos, mask = np.divmod(np.arange(start, stop), 1 << self._cells)
+            mask = mask.astype(np.uint64)
+            values[start:stop] = self.values(pos, mask)
+            policy[start:stop] = self.greedy_policy(pos, mask)
+
+        evaluation = MDP(self._grids, dynamics=self.dynamics)
+        evaluation.gamma = self.gamma
+        evaluation.theta = self.theta * (1 - self.gamma)
+        policy_values = evaluation.evaluate_policy(policy)
+        active = policy >= 0
+        loss = (exact_values - policy_values)[active]
+        return {'value_error': float(np.abs(values - exact_values).max()), 'policy_loss': float(loss.max()),
+                'mean_policy_loss': float(loss.mean()),
+                'agreement': float((policy[active] == exact_policy[active]).mean())}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Approximately solve a vacuum-world grid too large to enumerate.")
+    parser.add_argument("test_case", help="name of a test case in the test folder, e.g. test_case_11")
+    parser.add_argument("--dynamics", choices=sorted(DYNAMICS), default="vacuum")
+    parser.add_argument("--samples", type=int, default=10000, help="number of sampled states to fit on")
+    parser.add_argument("--max-mb", type=float, default=256, help="memory ceiling of the solver, in MB")
+    parser.add_argument("--max-sweeps", type=int, default=500, help="stop after this many sweeps")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the state sampler")
+    parser.add_argument("--gap", action="store_true",
+                        help="also solve the grid exactly and report how far the approximation is from it")
+    parser.add_argument("--query", nargs=3, action="append", metavar=("I", "J", "CLEANLINESS"),
+                        help="print the greedy action and approximate value of this state; may be given several times")
+    args = parser.parse_args()
+
+    grids = read_grid_from_file("test/" + args.test_case)
+    for row in grids:
+        print(row)
+    approximation = ApproximateMDP(grids, DYNAMICS[args.dynamics], args.samples, int(args.max_mb * 2 ** 20),
+                                   args.seed)
+    start_time = time.perf_counter()
+    _, iterations = approximation.solve(args.max_sweeps)
+    print(f"{iterations} sweeps ({approximation.stop_reason}) over {args.samples} samples in "
+          f"{time.perf_counter() - start_time:.2f} s, {approximation.nbytes() / 2 ** 20:.1f} MB")
+    for i, j, cleanliness in args.query or []:
+        state = (int(i), int(j), tuple(cleanliness))
+        print(f"{state}: {approximation.act(state)} {approximation.value(state):.4f}")
+    if args.gap:
+        for name, value in approximation.gap().items():
+            print(f"{name}: {value:.4f}")
@@ -0,0 +1,306 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from vacuum import (CLEANING_SUCCESS_PROBABILITY, DYNAMICS, MDP, VACUUM_DYNAMICS, SweepStats, read_grid_from_file,
+                    transition_outcomes)
+
+
+class BatchMDP:
+    """
+    Value iteration over several grids of the same shape in one vectorised
+    pass, for sweeps over many map variants.
+
+    Grids of one shape have the same states, successors and rewards; only the
+    cleaning success probabilities of their cells differ. The successor indices
+    and rewards are therefore compiled once and shared, and the grids become
+    the last axis of the probabilities and of ``V``: gathering the value of a
+    successor reads one contiguous row holding it for every grid, and a sweep
+    backs up all grids with the same few numpy calls per action. A grid leaves
+    the batch once it has converged, so its values, policy and number of sweeps
+    are exactly those of ``MDP.value_iteration`` on it alone.
+    """
+
+    def __init__(self, grids_list, start_states=None, dynamics=VACUUM_DYNAMICS):
+        """
+        :param grids_list: List of grid configurations, all of the same shape.
+        :param start_states: Optional list of (i, j, cleanliness) states; every
+            grid is then solved over the states reachable from them.
+        :param dynamics: vacuum.Dynamics, the action set and transition/reward rules.
+        """
+        if not grids_list:
+            raise ValueError("A batch needs at least one grid")
+        m, n = len(grids_list[0]), len(grids_list[0][0])
+        for grids in grids_list:
+            if (len(grids), len(grids[0])) != (m, n):
+                raise ValueError(f"Every grid of a batch must be {m}x{n}, got {len(grids)}x{len(grids[0])}")
+            for row in grids:
+                for cell_type in row:
+                    if cell_type not in dynamics.success_probability:
+                        raise ValueError(f"Unknown cell type {cell_type!r}, expected one of "
+                                         f"{tuple(dynamics.success_probability)}")
+        self._grids_list = grids_list
+        self._cells = m * n
+        self.dynamics = dynamics
+        # States, their keys and the goal states are the same for every grid, so
+        # the MDP of the first grid describes them all, e.g. to write solutions
+        self.template = MDP(grids_list[0], start_states, dynamics)
+        self.gamma = 0.90
+        self.theta = 1e-3
+        # One column of values per grid
+        self.V = np.repeat(self.template.V[:, None], len(grids_list), axis=1)
+        # Number of sweeps each grid took in the last solve
+        self.iterations = np.zeros(len(grids_list), dtype=np.int64)
+        self.backups = 0
+        # Optional function called with a vacuum.SweepStats after every sweep
+        self.callback = None
+        self._model = None
+
+    @property
+    def grid_num(self):
+        return len(self._grids_list)
+
+    @property
+    def state_num(self):
+        return self.template.state_num
+
+    @property
+    def model(self):
+        """
+        The compiled tables of the batch, built on first use.
+
+        :return: List per action code of (successor indices, rewards,
+            probabilities), see :meth:`compile`.
+        """
+        if self._model is None:
+            self._model = self.compile()
+        return self._model
+
+    def compile(self):
+        """
+        Compile the transition and reward rules of every grid. Every action has
+        at most two outcomes, so they are stored densely rather than in the CSR
+        layout of vacuum.CompiledModel; an action whose second outcome is
+        impossible in every state and grid keeps only the first. Padding
+        outcomes weigh 0, which leaves every sum unchanged.
+
+        Cleaning always happens on the cell the robot ends in, so the rules are
+        evaluated once per cell type, on a grid made only of it, and each grid
+        takes the probabilities of the type of that cell.
+
+        :return: List per action code of (successor indices of shape (states,
+            outcomes), rewards of that shape, probabilities of shape (states,
+            outcomes, grids), or None when every outcome is certain).
+        """
+        states = self.template.reachable_states
+        if states is None:
+            states = np.arange(self.state_num, dtype=np.int64)
+        index_type = np.int32 if self.state_num <= np.iinfo(np.int32).max else np.int64
+        pos, mask = np.divmod(states, 1 << self._cells)
+        m, n = len(self._grids_list[0]), len(self._grids_list[0][0])
+        cell_types = sorted({cell_type for grids in self._grids_list for row in grids for cell_type in row})
+        # Type of every cell of every grid, as a position in cell_types
+        types = np.array([[cell_types.index(cell_type) for row in grids for cell_type in row]
+                          for grids in self._grids_list])
+        model = []
+        for action in self.template.actions:
+            outcomes = [transition_outcomes([[cell_type] * n for _ in range(m)], self.dynamics, pos, mask, action)
+                        for cell_type in cell_types]
+            next_pos, next_mask, _, rewards = outcomes[0]
+            type_probs = np.stack([outcome[2] for outcome in outcomes])
+            # (states, grids) type of the cell each state's robot ends in
+            ends_in = types.T[next_pos[:, 0]]
+            probs = np.stack([type_probs[ends_in, np.arange(len(states))[:, None], outcome] for outcome in range(2)],
+                             axis=1)
+            successors = (next_pos << self._cells) | next_mask
+            if self.template.reachable_states is not None:
+                successors = np.searchsorted(states, successors)
+            used = 2 if (probs[:, 1] > 0).any() else 1
+            probs = np.ascontiguousarray(probs[:, :used])
+            model.append((np.ascontiguousarray(successors[:, :used], dtype=index_type),
+                          np.ascontiguousarray(rewards[:, :used, None]), None if (probs == 1).all() else probs))
+        return model
+
+    def q_values(self, v, start=0, stop=None, model=None):
+        """
+        :param v: Array of shape (states, grids), the values.
+        :param start: Integer, first state to back up.
+        :param stop: Optional integer, state to stop before, default the last.
+        :param model: Optional tables as returned by :meth:`compile`, default ``model``.
+        :return: List per action code of arrays of shape (stop - start, grids),
+            the action values under ``v``.
+        """
+        q = []
+        for successors, rewards, probs in self.model if model is None else model:
+            weighted = v[successors[start:stop]]
+            weighted *= self.gamma
+            weighted += rewards[start:stop]
+            if probs is not None:
+                weighted *= probs[start:stop]
+            # Outcomes are summed in MDP.transition order, as the single-grid solvers do
+            q.append(weighted[:, 0] + weighted[:, 1] if weighted.shape[1] == 2 else weighted[:, 0])
+        return q
+
+    def value_iteration(self, max_sweeps=None, block_size=None):
+        """
+        Synchronous value iteration of every grid at once, each stopping once
+        none of its values changes by ``theta`` or more. States are backed up
+        ``block_size`` at a time so that the intermediate arrays of a block stay
+        in cache however many grids are batched.
+
+        :param max_sweeps: Optional integer, stop every grid after this many sweeps.
+        :param block_size: Optional integer, number of states backed up
+            together, by default about 16384 values per action.
+        :return: Tuple of (value array, policy array of action codes, sweep
+            counts), the first two of shape (grids, states).
+        """
+        goal = np.zeros(self.state_num, dtype=bool)
+        goal[self.template.is_goal(np.arange(self.state_num))] = True
+        policy = np.full((self.grid_num, self.state_num), -1, dtype=np.int8)
+        backups = self.state_num - int(goal.sum())
+        track = self.callback is not None
+        # Greedy actions of the last sweep; as in MDP, every non-goal state
+        # counts as changed on the first one
+        previous = np.full(self.V.shape, -1, dtype=np.int8)
+
+        # Grids still being swept, with their columns of the tables and values
+        active = np.arange(self.grid_num)
+        model = self.model
+        v = self.V.copy()
+        v_new = np.empty_like(v)
+        iteration_number = 0
+        self.backups = 0
+        while len(active):
+            start_time = time.perf_counter()
+            size = block_size or max(64, (1 << 14) // len(active))
+            deltas = np.zeros(len(active))
+            greedy = np.empty(v.shape, dtype=np.int8) if track else None
+            for start in range(0, self.state_num, size):
+                stop = min(start + size, self.state_num)
+                q = self.q_values(v, start, stop, model)
+                v_new[start:stop] = np.where(goal[start:stop, None], v[start:stop], np.maximum.reduce(q))
+                np.maximum(deltas, np.abs(v_new[start:stop] - v[start:stop]).max(axis=0), out=deltas)
+                if track:
+                    greedy[start:stop] = np.argmax(q, axis=0)
+            v, v_new = v_new, v
+            iteration_number += 1
+            self.backups += backups * len(active)
+            if track:
+                changes = int((greedy[~goal] != previous[~goal]).sum())
+                self.callback(SweepStats(iteration_number, float(deltas.max()), time.perf_counter() - start_time,
+                                         backups * len(active), changes))
+                previous = greedy
+
+            done = deltas < self.theta
+            if max_sweeps is not None and iteration_number >= max_sweeps:
+                done[:] = True
+            if not done.any():
+                continue
+            finished = active[done]
+            self.V[:, finished] = v[:, done]
+            self.iterations[finished] = iteration_number
+            # The policy is greedy in the values the last sweep started from
+            if track:
+                greedy_done = greedy[:, done]
+            else:
+                last = np.ascontiguousarray(v_new[:, done])
+                done_model = [(successors, rewards, None if probs is None else np.ascontiguousarray(probs[..., done]))
+                              for successors, rewards, probs in model]
+                greedy_done = np.concatenate([np.argmax(self.q_values(last, start, start + size, done_model), axis=0)
+                                              for start in range(0, self.state_num, size)])
+            greedy_done = greedy_done.T.astype(np.int8)
+            greedy_done[:, goal] = -1
+            policy[finished] = greedy_done
+
+            active = active[~done]
+            v = np.ascontiguousarray(v[:, ~done])
+            v_new = np.empty_like(v)
+            model = [(successors, rewards, None if probs is None else np.ascontiguousarray(probs[..., ~done]))
+                     for successors, rewards, probs in model]
+            if track:
+                previous = previous[:, ~done]
+        return self.V.T, policy, self.iterations
+
+    def solve(self, solver='value_iteration', **kwargs):
+        """
+        Same interface as ``MDP.solve``; value iteration is the only batched solver.
+
+        :return: Tuple of (value array, policy array of action codes, sweep
+            counts), the first two of shape (grids, states).
+        """
+        if solver != 'value_iteration':
+            raise ValueError(f"Unknown batched solver {solver!r}, expected 'value_iteration'")
+        return self.value_iteration(**kwargs)
+
+
+def group_by_shape(grids_list):
+    """
+    :param grids_list: List of grid configurations.
+    :return: Dict mapping (m, n) to the positions in ``grids_list`` of the grids of that shape.
+    """
+    groups = {}
+    for k, grids in enumerate(grids_list):
+        groups.setdefault((len(grids), len(grids[0])), []).append(k)
+    return groups
+
+
+def random_grids(m, n, count, seed=0):
+    """
+    :param m: Integer, number of rows.
+    :param n: Integer, number of columns.
+    :param count: Integer, number of grids.
+    :param seed: Integer, seed of the layout generator.
+    :return: List of ``count`` random m x n layouts of the known cell types.
+    """
+    rng = random.Random(seed)
+    cell_types = sorted(CLEANING_SUCCESS_PROBABILITY)
+    return [[[rng.choice(cell_types) for _ in range(n)] for _ in range(m)] for _ in range(count)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Solve many grids of the same shape together with value iteration.")
+    parser.add_argument("test_cases", nargs="*",
+                        help="names of test cases in the test folder; cases are batched with those of their shape")
+    parser.add_argument("--random", nargs=3, type=int, metavar=("COUNT", "M", "N"),
+                        help="also solve COUNT random M x N layouts")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random layouts")
+    parser.add_argument("--dynamics", choices=sorted(DYNAMICS), default="vacuum")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="largest number of grids solved together; memory grows with it")
+    parser.add_argument("--compare", action="store_true",
+                        help="also solve every grid on its own and report the speedup and largest difference")
+    args = parser.parse_args()
+
+    names = list(args.test_cases)
+    grids_list = [read_grid_from_file("test/" + name) for name in names]
+    if args.random:
+        count, m, n = args.random
+        names += [f"random_{k}" for k in range(count)]
+        grids_list += random_grids(m, n, count, args.seed)
+    if not grids_list:
+        parser.error("give test cases or --random")
+
+    dynamics = DYNAMICS[args.dynamics]
+    for (m, n), members in sorted(group_by_shape(grids_list).items()):
+        for start in range(0, len(members), args.batch_size):
+            chunk = members[start:start + args.batch_size]
+            start_time = time.perf_counter()
+            batch = BatchMDP([grids_list[k] for k in chunk], dynamics=dynamics)
+            v, policy, iterations = batch.solve()
+            elapsed = time.perf_counter() - start_time
+            print(f"{m}x{n}: {len(chunk)} grids, {batch.state_num} states each, {elapsed:.3f} s, "
+                  f"sweeps {iterations.min()}-{iterations.max()}")
+            if args.compare:
+                start_time = time.perf_counter()
+                difference = 0.0
+                for row, k in enumerate(chunk):
+                    mdp = MDP(grids_list[k], dynamics=dynamics)
+                    single_v, single_policy, _ = mdp.solve('value_iteration')
+                    difference = max(difference, float(np.abs(single_v - v[row]).max()))
+                    if not np.array_equal(single_policy, policy[row]):
+                        print(f"  policy of {names[k]} differs from the single-grid solve")
+                single_elapsed = time.perf_counter() - start_time
+                print(f"  one at a time: {single_elapsed:.3f} s ({single_elapsed / elapsed:.1f}x), "
+                      f"largest value difference {difference:.3g}")
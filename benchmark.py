@@ -0,0 +1,210 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from vacuum import DYNAMICS, MDP, SOLVERS
+
+# Grid shapes in increasing number of cells
+SHAPES = [(1, 2), (1, 4), (2, 2), (2, 3), (1, 8), (3, 3), (2, 5), (3, 4), (2, 7), (4, 4)]
+# Solver runs as (name, solver, keyword arguments); every solver plus the
+# reference loop backend of value iteration
+CONFIGURATIONS = [('value_iteration', 'value_iteration', {'backend': 'numpy'}),
+                  ('value_iteration_loop', 'value_iteration', {'backend': 'loop'})] + \
+                 [(solver, solver, {}) for solver in SOLVERS if solver != 'value_iteration']
+# Solvers that back up states straight from the transition rules
+MODEL_FREE_SOLVERS = ('chunked',)
+CSV_COLUMNS = ['configuration', 'dynamics', 'm', 'n', 'state_num', 'iterations', 'backups', 'init_time',
+               'compile_time', 'solve_time', 'solve_time_min', 'backups_per_second', 'peak_rss_mb']
+
+
+def make_grid(m, n):
+    """
+    Build an m x n grid cycling through the three cell types.
+
+    :param m: Integer, number of rows.
+    :param n: Integer, number of columns.
+    :return: List of Lists, the grid configuration.
+    """
+    return [['vtT'[(i * n + j) % 3] for j in range(n)] for i in range(m)]
+
+
+def measure(grids, solver, options, dynamics='vacuum', repeats=3, warmup=1):
+    """
+    Build and solve one grid ``warmup + repeats`` times and report the median of
+    the measured runs. Each run times building the state space
+    (``MDP.__init__``), compiling the model and solving separately. The loop
+    backend and the chunked solver never use the compiled model, so it is not
+    built for them: their compile time is 0 and their peak RSS leaves it out.
+
+    :param grids: List of Lists, the grid configuration.
+    :param solver: String, one of vacuum.SOLVERS.
+    :param options: Dict of keyword arguments for the solver.
+    :param dynamics: String, a key of vacuum.DYNAMICS.
+    :param repeats: Integer, number of measured runs.
+    :param warmup: Integer, number of runs done first and discarded.
+    :return: Dict of measurements.
+    """
+    runs = []
+    for _ in range(warmup + repeats):
+        start_time = time.perf_counter()
+        mdp = MDP(grids, dynamics=DYNAMICS[dynamics])
+        init_time = time.perf_counter() - start_time
+        compile_time = 0.0
+        if options.get('backend') != 'loop' and solver not in MODEL_FREE_SOLVERS:
+            start_time = time.perf_counter()
+            mdp.model
+            compile_time = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        _, _, iterations = mdp.solve(solver, **options)
+        solve_time = time.perf_counter() - start_time
+        runs.append((init_time, compile_time, solve_time))
+    init_times, compile_times, solve_times = zip(*runs[warmup:])
+    solve_time = statistics.median(solve_times)
+    return {'state_num': mdp.state_num, 'iterations': iterations, 'backups': mdp.backups,
+            'init_time': statistics.median(init_times), 'compile_time': statistics.median(compile_times),
+            'solve_time': solve_time, 'solve_time_min': min(solve_times),
+            'backups_per_second': mdp.backups / solve_time if solve_time > 0 else None}
+
+
+def _measure_in_child(grids, solver, options, dynamics, repeats, warmup, connection):
+    result = measure(grids, solver, options, dynamics, repeats, warmup)
+    try:
+        import resource
+    except ImportError:
+        # Only Unix has the resource module; peak RSS is not measured elsewhere
+        result['peak_rss_mb'] = None
+    else:
+        # ru_maxrss is in kilobytes on Linux
+        result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    connection.send(result)
+
+
+def run_benchmark(shapes, configurations, dynamics='vacuum', repeats=3, warmup=1, loop_max_cells=9):
+    """
+    Measure every configuration on every shape, each in a fresh child process so
+    that its peak RSS is its own.
+
+    :param shapes: List of (m, n) grid shapes.
+    :param configurations: List of (name, solver, keyword arguments).
+    :param dynamics: String, a key of vacuum.DYNAMICS.
+    :param repeats: Integer, number of measured runs per configuration and shape.
+    :param warmup: Integer, number of discarded runs before them.
+    :param loop_max_cells: Integer, largest grid run with the loop backend.
+    :return: Generator of result dicts, one per configuration and shape.
+    """
+    for name, solver, options in configurations:
+        for m, n in shapes:
+            if options.get('backend') == 'loop' and m * n > loop_max_cells:
+                continue
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_measure_in_child,
+                                              args=(make_grid(m, n), solver, options, dynamics, repeats, warmup,
+                                                    sender))
+            process.start()
+            sender.close()
+            result = receiver.recv()
+            process.join()
+            yield dict({'configuration': name, 'dynamics': dynamics, 'm': m, 'n': n}, **result)
+
+
+def environment():
+    """
+    :return: Dict describing the code and machine the benchmark ran on.
+    """
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+            'numpy': np.__version__, 'platform': platform.platform(), 'cpus': multiprocessing.cpu_count()}
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Flag configurations whose median solve time grew by more than ``tolerance``
+    relative to a baseline run of the same configuration, dynamics and shape.
+
+    :param results: List of result dicts.
+    :param baseline: List of result dicts from an earlier run.
+    :param tolerance: Float, allowed relative slowdown.
+    :return: List of (result, baseline result, relative change) for the regressions.
+    """
+    def key(result):
+        return result['configuration'], result['dynamics'], result['m'], result['n']
+
+    previous = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or not old['solve_time']:
+            continue
+        change = result['solve_time'] / old['solve_time'] - 1
+        if change > tolerance:
+            regressions.append((result, old, change))
+    return regressions
+
+
+if __name__ == '__main__':
+    names = [name for name, _, _ in CONFIGURATIONS]
+    parser = argparse.ArgumentParser(description="Measure how build and solve time scale with grid size.")
+    parser.add_argument("--configurations", nargs="+", choices=names, default=names,
+                        help="solver runs to measure")
+    parser.add_argument("--dynamics", choices=sorted(DYNAMICS), default="vacuum")
+    parser.add_argument("--max-cells", type=int, default=16, help="largest grid size to run")
+    parser.add_argument("--loop-max-cells", type=int, default=9,
+                        help="largest grid size to run with the per-state loop backend")
+    parser.add_argument("--repeats", type=int, default=3, help="measured runs per configuration and grid")
+    parser.add_argument("--warmup", type=int, default=1, help="discarded runs before the measured ones")
+    parser.add_argument("--json", help="write the environment and results to this JSON file")
+    parser.add_argument("--csv", help="also write the results to this CSV file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to flag solve time regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="relative solve time increase reported as a regression")
+    args = parser.parse_args()
+
+    shapes = [(m, n) for m, n in SHAPES if m * n <= args.max_cells]
+    configurations = [configuration for configuration in CONFIGURATIONS if configuration[0] in args.configurations]
+
+    results = []
+    print(f"{'Configuration':<28}{'Grid':>6}{'States':>10}{'Iters':>7}{'Init (s)':>10}{'Compile (s)':>13}"
+          f"{'Solve (s)':>11}{'Backups/s':>12}{'RSS (MB)':>10}")
+    for result in run_benchmark(shapes, configurations, args.dynamics, args.repeats, args.warmup,
+                                args.loop_max_cells):
+        results.append(result)
+        grid = f"{result['m']}x{result['n']}"
+        backups_per_second = result['backups_per_second'] or 0
+        peak_rss = 'n/a' if result['peak_rss_mb'] is None else f"{result['peak_rss_mb']:.1f}"
+        print(f"{result['configuration']:<28}{grid:>6}"
+              f"{result['state_num']:>10}{result['iterations']:>7}{result['init_time']:>10.4f}"
+              f"{result['compile_time']:>13.4f}{result['solve_time']:>11.4f}{backups_per_second:>12.3g}"
+              f"{peak_rss:>10}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'environment': environment(), 'results': results}, f, indent=2)
+
+    if args.csv:
+        with open(args.csv, 'w') as f:
+            f.write(",".join(CSV_COLUMNS) + "\n")
+            for result in results:
+                f.write(",".join("" if result[column] is None else str(result[column])
+                                 for column in CSV_COLUMNS) + "\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for result, old, change in regressions:
+            print(f"Regression: {result['configuration']} {result['m']}x{result['n']} solve time "
+                  f"{old['solve_time']:.4f} s -> {result['solve_time']:.4f} s ({change:+.0%})")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,151 @@
+import argparse
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from solution_file import NO_ACTION, Solution, load_solution
+from vacuum import MDP, read_grid_from_file
+
+
+class PolicyService:
+    """
+    Answers best action / value queries against one solved grid, which is loaded
+    once and kept in memory (or memory-mapped from a binary solution file).
+    """
+
+    def __init__(self, solution):
+        """
+        :param solution: solution_file.Solution.
+        """
+        self.solution = solution
+        # Action names indexed by stored code, with None for goal states
+        self._action_names = np.array(list(solution.actions) + [None] * (NO_ACTION + 1 - len(solution.actions)),
+                                      dtype=object)
+
+    @classmethod
+    def from_file(cls, filename):
+        return cls(load_solution(filename))
+
+    @classmethod
+    def from_grid(cls, grids, solver='value_iteration'):
+        """
+        Solve a grid with vacuum.MDP and serve the result.
+
+        :param grids: List of Lists, the grid configuration.
+        :param solver: String, one of vacuum.SOLVERS.
+        :return: PolicyService.
+        """
+        mdp = MDP(grids)
+        v, policy, _ = mdp.solve(solver)
+        return cls(Solution.from_mdp(mdp, v, policy, solver))
+
+    def lookup(self, i, j, dirt):
+        """
+        :param i: Integer, the robot's row.
+        :param j: Integer, the robot's column.
+        :param dirt: String, the cleanliness of every cell, e.g. 'dcdd'.
+        :return: Tuple of (best action or None for a goal state, value).
+        """
+        index = self.solution.index((i, j, dirt))
+        return self._action_names[self.solution.policy[index]], float(self.solution.values[index])
+
+    def lookup_batch(self, i, j, dirt):
+        """
+        Vectorised :meth:`lookup` for many states at once.
+
+        :param i: Sequence of rows.
+        :param j: Sequence of columns.
+        :param dirt: Sequence of cleanliness strings.
+        :return: Tuple of (list of actions, list of values).
+        """
+        indices = self.solution.indices(i, j, dirt)
+        return self._action_names[self.solution.policy[indices]].tolist(), self.solution.values[indices].tolist()
+
+    def info(self):
+        return {'grid': [''.join(row) for row in self.solution.grid], 'gamma': self.solution.gamma,
+                'theta': self.solution.theta, 'actions': self.solution.actions, 'solver': self.solution.solver,
+                'state_num': self.solution.state_num}
+
+
+class PolicyRequestHandler(BaseHTTPRequestHandler):
+    """
+    ``GET /lookup?i=0&j=1&dirt=dcdd`` answers one state, ``POST /lookup`` with a
+    JSON body ``{"states": [[i, j, "dcdd"], ...]}`` answers a batch, and
+    ``GET /info`` describes the served grid.
+    """
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without TCP_NODELAY each
+    # keep-alive response would stall on delayed ACKs
+    disable_nagle_algorithm = True
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/info':
+            self._reply(200, self.service.info())
+        elif url.path == '/lookup':
+            query = parse_qs(url.query)
+            try:
+                action, value = self.service.lookup(int(query['i'][0]), int(query['j'][0]), query['dirt'][0])
+            except (KeyError, ValueError) as e:
+                self._reply(400, {'error': str(e)})
+                return
+            self._reply(200, {'action': action, 'value': value})
+        else:
+            self._reply(404, {'error': f"Unknown path {url.path}"})
+
+    def do_POST(self):
+        if urlparse(self.path).path != '/lookup':
+            self._reply(404, {'error': f"Unknown path {self.path}"})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            i, j, dirt = zip(*body['states']) if body['states'] else ((), (), ())
+            actions, values = self.service.lookup_batch(i, j, dirt)
+        except (KeyError, TypeError, ValueError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        self._reply(200, {'actions': actions, 'values': values})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Planners query in a tight loop, so do not log every request
+        pass
+
+
+def make_server(service, host='127.0.0.1', port=8620):
+    """
+    :param service: PolicyService to answer queries with.
+    :param host: String, address to bind.
+    :param port: Integer, port to bind, 0 for any free port.
+    :return: ThreadingHTTPServer, not yet serving.
+    """
+    handler = type('BoundPolicyRequestHandler', (PolicyRequestHandler,), {'service': service})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Serve best action / value lookups for a solved grid.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--solution", help="binary solution file written with vacuum.py --format binary")
+    source.add_argument("--grid", help="test case file to solve at startup")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8620)
+    args = parser.parse_args()
+
+    if args.solution:
+        service = PolicyService.from_file(args.solution)
+    else:
+        service = PolicyService.from_grid(read_grid_from_file(args.grid))
+    server = make_server(service, args.host, args.port)
+    print(f"Serving {service.solution.state_num} states on http://{args.host}:{server.server_port}")
+    server.serve_forever()
@@ -0,0 +1,342 @@
+import argparse
+import random
+import time
+
+import numpy as np
+
+from solution_file import pack_state, unpack_state
+from vacuum import DYNAMICS, GOAL_VALUE, MAX_CELLS, VACUUM_DYNAMICS, read_grid_from_file, transition_outcomes
+
+
+class RTDPPlanner:
+    """
+    Anytime online planner: labelled real-time dynamic programming (LRTDP,
+    Bonet and Geffner 2003) from the robot's current state. Trials follow the
+    greedy policy from that state, backing up only the states they visit, and
+    states whose greedy envelope has converged are labelled solved. Values start
+    at an admissible heuristic, an upper bound on the optimal value, so the
+    greedy action is usable as soon as the time budget runs out and becomes
+    optimal once the query state is solved.
+
+    Nothing is enumerated up front, so any grid of up to 64 cells can be
+    planned on. Values and labels are kept between queries and the robot's next
+    state usually starts out partly solved.
+    """
+
+    def __init__(self, _grids, dynamics=VACUUM_DYNAMICS, seed=0):
+        """
+        :param _grids: List of Lists, the grid configuration.
+        :param dynamics: vacuum.Dynamics, the action set and transition/reward rules.
+        :param seed: Integer, seed of the successor sampling of trials.
+        """
+        self._grids = _grids
+        self._m = len(_grids)
+        self._n = len(_grids[0])
+        self._cells = self._m * self._n
+        if self._cells > MAX_CELLS:
+            raise ValueError(f"Grids of up to {MAX_CELLS} cells are supported, got {self._cells}")
+        self.dynamics = dynamics
+        self._actions = list(dynamics.actions)
+        self.gamma = 0.90
+        # Largest residual of a state labelled solved
+        self.theta = 1e-3
+        # Longest trial before it is cut and labelling starts
+        self.max_depth = 1000
+        self.backups = 0
+        self.trials = 0
+        # Why the last call to plan returned: 'solved' or 'time_limit'
+        self.stop_reason = None
+        self._random = random.Random(seed)
+        self._distances = [[abs(k // self._n - c // self._n) + abs(k % self._n - c % self._n)
+                            for c in range(self._cells)] for k in range(self._cells)]
+        self._compile_rules()
+        self.reset()
+
+    @property
+    def actions(self):
+        return list(self._actions)
+
+    def reset(self):
+        """
+        Forget every value and label, e.g. after the grid changed.
+        """
+        self._values = {}
+        self._solved = set()
+        self._successors = {}
+
+    def update_cell(self, i, j, cell_type):
+        """
+        Change the type of one cell. Values learned on the old grid are no
+        longer bounds, so they are dropped.
+
+        :param i: Integer, the row of the cell.
+        :param j: Integer, the column of the cell.
+        :param cell_type: String, one of the cell types of the dynamics.
+        """
+        if cell_type not in self.dynamics.success_probability:
+            raise ValueError(f"Unknown cell type {cell_type!r}, expected one of "
+                             f"{tuple(self.dynamics.success_probability)}")
+        self._grids = [list(row) for row in self._grids]
+        self._grids[i][j] = cell_type
+        self._compile_rules()
+        self.reset()
+
+    def _compile_rules(self):
+        """
+        Run transition_outcomes once for every robot position, action and dirt
+        of the robot's cell and of the cell the action leads to, the only cells
+        the rules look at. Expanding a state is then a table lookup:
+        ``_rules[code][pos * 4 + combination]`` lists (next position, bit
+        cleared, probability, reward) for the outcomes of positive probability,
+        where bit 0 of ``combination`` is the robot's cell being dirty and
+        bit 1 the target cell, ``_targets[code][pos]``.
+        """
+        pos = np.repeat(np.arange(self._cells), 4)
+        combination = np.tile(np.arange(4), self._cells)
+        source_bit = np.left_shift(np.uint64(1), (self._cells - 1 - pos).astype(np.uint64))
+        self._rules = []
+        self._targets = []
+        for action in self._actions:
+            # Where the action leads does not depend on dirt
+            target = transition_outcomes(self._grids, self.dynamics, pos, np.zeros(len(pos), dtype=np.uint64),
+                                         action)[0][:, 0]
+            self._targets.append(target[::4].tolist())
+            target_bit = np.left_shift(np.uint64(1), (self._cells - 1 - target).astype(np.uint64))
+            mask = np.where(combination & 1, source_bit, 0) | np.where(combination & 2, target_bit, 0)
+            next_pos, next_mask, probs, rewards = transition_outcomes(self._grids, self.dynamics, pos, mask, action)
+            cleared = mask[:, None] ^ next_mask
+            self._rules.append([[(int(next_pos[row, k]), int(cleared[row, k]), float(probs[row, k]),
+                                  float(rewards[row, k])) for k in range(next_pos.shape[1]) if probs[row, k] > 0]
+                                for row in range(len(pos))])
+
+    def _expand(self, state):
+        """
+        :param state: Integer, a packed state.
+        :return: Tuple per action code of (next state, probability, reward) outcomes.
+        """
+        successors = self._successors.get(state)
+        if successors is None:
+            pos, mask = state >> self._cells, state & ((1 << self._cells) - 1)
+            source = (mask >> (self._cells - 1 - pos)) & 1
+            successors = []
+            for rules, targets in zip(self._rules, self._targets):
+                combination = source | ((mask >> (self._cells - 1 - targets[pos])) & 1) << 1
+                successors.append(tuple(((next_pos << self._cells) | (mask & ~cleared), prob, reward)
+                                        for next_pos, cleared, prob, reward in rules[pos * 4 + combination]))
+            # Tuples of numbers are untracked by the garbage collector, which keeps
+            # its pauses short as the cache grows
+            successors = tuple(successors)
+            self._successors[state] = successors
+        return successors
+
+    def heuristic(self, state):
+        """
+        Admissible upper bound on the optimal value of a packed state. Reaching
+        the goal takes at least as many moves as visiting every dirty cell needs
+        and, with a 'vacuum' action, one cleaning step per dirty cell. The best
+        trajectory imaginable takes the best reward on every cleaning step (at
+        most one per dirty cell) and the best other reward on every other step,
+        then reaches the goal as early as the counts allow. With
+        ``clean_on_entry`` a move can earn every reward, so every step is
+        bounded by the best one.
+
+        :param state: Integer, a packed state.
+        :return: Float.
+        """
+        pos, mask = state >> self._cells, state & ((1 << self._cells) - 1)
+        if mask == 0:
+            return float(GOAL_VALUE)
+        dirty = bin(mask).count('1')
+        own = (mask >> (self._cells - 1 - pos)) & 1
+        others = dirty - own
+        nearest = self._m + self._n
+        distances = self._distances[pos]
+        remaining = mask & ~(1 << (self._cells - 1 - pos))
+        while remaining:
+            bit = remaining.bit_length() - 1
+            nearest = min(nearest, distances[self._cells - 1 - bit])
+            remaining &= ~(1 << bit)
+
+        rewards = self.dynamics.rewards
+        if self.dynamics.clean_on_entry:
+            # Cleaning the robot's own cell takes leaving it and coming back
+            first = min(nearest if others else 2, 2 if own else nearest)
+            steps = first + dirty - 1
+            bonus_steps = 0
+            best = rest = max(rewards.values())
+        else:
+            moves = nearest + others - 1 if others else 0
+            steps = dirty + moves
+            bonus_steps = dirty
+            rest = max(reward for kind, reward in rewards.items() if kind != 'clean')
+            best = max(rewards['clean'], rest)
+        gamma = self.gamma
+        # Value of bonus_steps best rewards, then rest rewards for ever, plus
+        # gamma**T times what reaching the goal at T adds to that
+        constant = best * (1 - gamma ** bonus_steps) / (1 - gamma) + rest * gamma ** bonus_steps / (1 - gamma)
+        goal_gain = GOAL_VALUE - rest / (1 - gamma)
+        return constant + gamma ** steps * goal_gain if goal_gain > 0 else constant
+
+    def _value(self, state):
+        value = self._values.get(state)
+        if value is None:
+            value = self._values[state] = self.heuristic(state)
+        return value
+
+    def _is_goal(self, state):
+        return state & ((1 << self._cells) - 1) == 0
+
+    def _greedy(self, state):
+        """
+        :return: Tuple of (best action code, its action value).
+        """
+        best_code, best_value = None, float('-inf')
+        for code, outcomes in enumerate(self._expand(state)):
+            value = 0.0
+            for next_state, prob, reward in outcomes:
+                value += prob * (reward + self.gamma * self._value(next_state))
+            if value > best_value:
+                best_code, best_value = code, value
+        return best_code, best_value
+
+    def _backup(self, state):
+        """
+        :return: Tuple of (greedy action code, residual of the backup).
+        """
+        code, value = self._greedy(state)
+        residual = abs(value - self._value(state))
+        self._values[state] = value
+        self.backups += 1
+        return code, residual
+
+    def _sample(self, outcomes):
+        # Collapsed outcomes of MDP.transition can leave probabilities summing below 1
+        threshold = self._random.random() * sum(prob for _, prob, _ in outcomes)
+        for next_state, prob, _ in outcomes:
+            threshold -= prob
+            if threshold < 0:
+                return next_state
+        return outcomes[-1][0]
+
+    def _check_solved(self, state, deadline):
+        """
+        Label ``state`` and its greedy envelope solved when every state in it has
+        a residual below ``theta``; otherwise back the envelope up.
+
+        :return: Boolean, whether ``state`` is now solved.
+        """
+        solved = True
+        open_states = [state]
+        closed = []
+        seen = {state}
+        while open_states:
+            current = open_states.pop()
+            closed.append(current)
+            if self._is_goal(current):
+                continue
+            code, value = self._greedy(current)
+            if abs(value - self._value(current)) > self.theta:
+                solved = False
+                continue
+            for next_state, _, _ in self._expand(current)[code]:
+                if next_state not in self._solved and next_state not in seen:
+                    seen.add(next_state)
+                    open_states.append(next_state)
+            if deadline is not None and time.perf_counter() >= deadline:
+                # Out of time: leave the envelope unlabelled, its values are still bounds
+                return False
+        if solved:
+            self._solved.update(closed)
+        else:
+            for current in reversed(closed):
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+                if not self._is_goal(current):
+                    self._backup(current)
+        return solved
+
+    def _trial(self, state, deadline):
+        visited = []
+        while state not in self._solved and len(visited) < self.max_depth:
+            visited.append(state)
+            if self._is_goal(state):
+                break
+            code, _ = self._backup(state)
+            state = self._sample(self._expand(state)[code])
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+        while visited:
+            if not self._check_solved(visited.pop(), deadline):
+                break
+
+    def plan(self, state, time_limit=None):
+        """
+        Run trials from ``state`` until it is solved or ``time_limit`` seconds
+        have passed, then act greedily.
+
+        :param state: Tuple, (i, j, sequence of 'c'/'d').
+        :param time_limit: Optional float, seconds to plan for; None plans until
+            the state is solved.
+        :return: String, the greedy action, or None for a goal state.
+        """
+        deadline = None if time_limit is None else time.perf_counter() + time_limit
+        packed = pack_state(state, self._n, self._cells)
+        if self._is_goal(packed):
+            self.stop_reason = 'solved'
+            return None
+        while packed not in self._solved:
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            self._trial(packed, deadline)
+            self.trials += 1
+        self.stop_reason = 'solved' if packed in self._solved else 'time_limit'
+        return self._actions[self._greedy(packed)[0]]
+
+    def value(self, state):
+        """
+        :param state: Tuple, (i, j, sequence of 'c'/'d').
+        :return: Float, the current value of ``state``: an upper bound on its
+            optimal value, within ``theta``-level error of it once solved.
+        """
+        return self._value(pack_state(state, self._n, self._cells))
+
+    def is_solved(self, state):
+        return pack_state(state, self._n, self._cells) in self._solved
+
+    def step(self, state, action):
+        """
+        Sample the state an action leads to, e.g. to simulate the robot.
+
+        :param state: Tuple, (i, j, sequence of 'c'/'d').
+        :param action: String, the action.
+        :return: Tuple, the next (i, j, tuple of 'c'/'d') state.
+        """
+        packed = self._sample(self._expand(pack_state(state, self._n, self._cells))[self._actions.index(action)])
+        return unpack_state(packed, self._n, self._cells)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Plan online from one state of a vacuum-world grid with LRTDP.")
+    parser.add_argument("test_case", help="name of a test case in the test folder, e.g. test_case_11")
+    parser.add_argument("start", nargs=3, metavar=("I", "J", "CLEANLINESS"),
+                        help="the robot's row, column and the cleanliness of every cell, e.g. 0 0 dcdd")
+    parser.add_argument("--dynamics", choices=sorted(DYNAMICS), default="vacuum")
+    parser.add_argument("--time-limit", type=float, default=0.005, help="seconds to plan for before every action")
+    parser.add_argument("--steps", type=int, default=1, help="number of actions to plan and simulate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    grids = read_grid_from_file("test/" + args.test_case)
+    for row in grids:
+        print(row)
+    planner = RTDPPlanner(grids, DYNAMICS[args.dynamics], args.seed)
+    state = (int(args.start[0]), int(args.start[1]), tuple(args.start[2]))
+    for _ in range(args.steps):
+        start_time = time.perf_counter()
+        action = planner.plan(state, args.time_limit)
+        elapsed = time.perf_counter() - start_time
+        print(f"{state}: {action} (value {planner.value(state):.4f}, {planner.stop_reason}, "
+              f"{elapsed * 1000:.2f} ms, {planner.backups} backups so far)")
+        if action is None:
+            break
+        state = planner.step(state, action)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from solution_file import NO_ACTION, load_solution, save_binary_solution
+
+DEFAULT_CACHE_DIR = '.solution_cache'
+
+
+class SolutionCache:
+    """
+    Content-addressed on-disk cache of solved grids, stored as binary solution
+    files.
+
+    A file is named ``<family>-<key>.bin``. The family hashes everything that
+    defines the MDP: grid, dynamics (action set and rules), gamma and, for
+    reachable-only models, the states. The key also adds the value dtype, theta,
+    the solver and its options.
+    An exact hit is returned without solving. Otherwise, unless ``warm_start``
+    is off, the cached solution of the same family with the tightest theta
+    seeds ``V`` instead of starting from zero. The least recently used files are evicted once the directory grows
+    past ``max_bytes``.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=1 << 30, warm_start=True):
+        """
+        :param directory: String, folder holding the cached solutions.
+        :param max_bytes: Integer, size above which old solutions are evicted.
+        :param warm_start: Boolean, whether a miss starts from a cached solution
+            of the same family; turn it off when solve times and iteration
+            counts are being compared.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.warm_start_enabled = warm_start
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def family(mdp):
+        """
+        :param mdp: vacuum.MDP.
+        :return: String, hash of the grid, dynamics, actions, gamma and state set.
+        """
+        description = json.dumps({'grid': [''.join(row) for row in mdp.grids], 'dynamics': mdp.dynamics,
+                                  'actions': mdp.actions, 'gamma': mdp.gamma}).encode()
+        digest = hashlib.sha256(description)
+        if mdp.reachable_states is not None:
+            digest.update(np.ascontiguousarray(mdp.reachable_states, dtype=np.int64).tobytes())
+        return digest.hexdigest()[:32]
+
+    def path(self, mdp, solver, options=None):
+        """
+        :param mdp: vacuum.MDP.
+        :param solver: String, the solver name.
+        :param options: Optional dict of solver keyword arguments.
+        :return: String, the file a solution of ``mdp`` with ``solver`` is cached in.
+        """
+        family = self.family(mdp)
+        description = json.dumps([family, str(mdp.V.dtype), mdp.theta, solver, options or {}], sort_keys=True)
+        key = hashlib.sha256(description.encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"{family}-{key}.bin")
+
+    def get(self, mdp, solver, options=None):
+        """
+        :return: solution_file.Solution, or None when it is not cached.
+        """
+        path = self.path(mdp, solver, options)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return load_solution(path)
+
+    def put(self, mdp, v, policy, solver, options=None, iterations=None):
+        """
+        Store a solution, then evict old ones if the cache is too large.
+        """
+        path = self.path(mdp, solver, options)
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        save_binary_solution(temp_path, mdp, v, policy, str(mdp.V.dtype), solver=solver, iterations=iterations)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def warm_start(self, mdp):
+        """
+        :return: solution_file.Solution of the same family with the tightest
+            theta, or None when there is none.
+        """
+        prefix = self.family(mdp) + '-'
+        candidates = [load_solution(os.path.join(self.directory, name)) for name in os.listdir(self.directory)
+                      if name.startswith(prefix) and name.endswith('.bin')]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda solution: solution.theta)
+
+    @staticmethod
+    def _indices(mdp, solution):
+        """
+        :return: Positions in ``solution`` of the states of ``mdp``; files of a
+            model reduced by symmetry hold every state it stands for.
+        """
+        if not mdp.symmetries:
+            return slice(None)
+        return solution.packed_indices(mdp.reachable_states)
+
+    def evict(self):
+        """
+        Remove the least recently used solutions until the cache fits in ``max_bytes``.
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.bin'):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def solve(self, mdp, solver='value_iteration', **kwargs):
+        """
+        Drop-in replacement for ``mdp.solve``: return the cached solution on a
+        hit, otherwise solve (warm-started when possible) and cache the result.
+        ``V`` keeps the dtype of ``mdp`` either way.
+
+        :param mdp: vacuum.MDP.
+        :param solver: String, one of vacuum.SOLVERS.
+        :param kwargs: Extra keyword arguments for the solver.
+        :return: Tuple of (value array, policy array of action codes, iteration count).
+        """
+        cached = self.get(mdp, solver, kwargs)
+        if cached is not None:
+            indices = self._indices(mdp, cached)
+            mdp.V = np.array(cached.values[indices], dtype=mdp.V.dtype)
+            codes = cached.policy[indices]
+            policy = codes.astype(np.int8)
+            policy[codes == NO_ACTION] = -1
+            return mdp.V, policy, cached.iterations
+
+        warm = self.warm_start(mdp) if self.warm_start_enabled else None
+        if warm is not None:
+            mdp.V = np.array(warm.values[self._indices(mdp, warm)], dtype=mdp.V.dtype)
+        v, policy, iterations = mdp.solve(solver, **kwargs)
+        self.put(mdp, v, policy, solver, kwargs, iterations)
+        return v, policy, iterations
@@ -0,0 +1,541 @@
+import argparse
+import bz2
+import gzip
+import json
+import lzma
+import struct
+from itertools import product
+
+import numpy as np
+
+MAGIC = b'VACSOL\x00\x01'
+VALUE_DTYPES = ('float64', 'float32')
+# Action code stored for goal states, which have no policy entry
+NO_ACTION = 255
+_ALIGNMENT = 64
+# Stdlib compressions of text solutions and their file name suffixes
+COMPRESSIONS = {'gzip': '.gz', 'bz2': '.bz2', 'lzma': '.xz'}
+_OPENERS = {'gzip': gzip.open, 'bz2': bz2.open, 'lzma': lzma.open}
+_COMPRESSION_MAGIC = ((b'\x1f\x8b', 'gzip'), (b'BZh', 'bz2'), (b'\xfd7zXZ\x00', 'lzma'))
+
+
+def pack_state(state, n, cells):
+    """
+    Packed id of an ``(i, j, cleanliness)`` state, the same as vacuum.MDP uses
+    for its full state space.
+
+    :param state: Tuple, (i, j, sequence of 'c'/'d').
+    :param n: Integer, number of columns of the grid.
+    :param cells: Integer, number of cells of the grid.
+    :return: Integer, the packed id.
+    """
+    i, j, cleanliness = state
+    mask = 0
+    for cell in cleanliness:
+        mask = (mask << 1) | (cell == 'd')
+    return ((i * n + j) << cells) | mask
+
+
+def unpack_state(packed, n, cells):
+    """
+    :param packed: Integer, a packed state id.
+    :param n: Integer, number of columns of the grid.
+    :param cells: Integer, number of cells of the grid.
+    :return: Tuple, (i, j, tuple of 'c'/'d').
+    """
+    pos, mask = divmod(int(packed), 1 << cells)
+    i, j = divmod(pos, n)
+    return i, j, tuple('d' if (mask >> (cells - 1 - k)) & 1 else 'c' for k in range(cells))
+
+
+def unpack_masks(masks, cells, strings=False):
+    """
+    Vectorised cleanliness part of :func:`unpack_state`. Each cleanliness is
+    joined from the halves of its mask, so the tables built have
+    ``2**(cells // 2)`` entries rather than one per mask.
+
+    :param masks: Sequence of dirt masks.
+    :param cells: Integer, number of cells of the grid.
+    :param strings: Boolean, whether to return 'cd' strings instead of tuples.
+    :return: List with the cleanliness of every mask.
+    """
+    low_cells = cells // 2
+    low_masks = 1 << low_cells
+    join = ''.join if strings else tuple
+    high = [join(cleanliness) for cleanliness in product('cd', repeat=cells - low_cells)]
+    low = [join(cleanliness) for cleanliness in product('cd', repeat=low_cells)]
+    return [high[mask >> low_cells] + low[mask & (low_masks - 1)] for mask in np.asarray(masks).tolist()]
+
+
+def pack_states(i, j, dirt, n, cells):
+    """
+    Vectorised :func:`pack_state`.
+
+    :param i: Sequence of row indices.
+    :param j: Sequence of column indices.
+    :param dirt: Sequence of cleanliness strings of length ``cells``, e.g. 'dcdd'.
+    :param n: Integer, number of columns of the grid.
+    :param cells: Integer, number of cells of the grid.
+    :return: Array of packed ids.
+    """
+    i = np.asarray(i, dtype=np.int64)
+    j = np.asarray(j, dtype=np.int64)
+    if np.any((i < 0) | (i >= cells // n) | (j < 0) | (j >= n)):
+        raise ValueError("Robot position outside the grid")
+    encoded = [cleanliness.encode() if isinstance(cleanliness, str) else ''.join(cleanliness).encode()
+               for cleanliness in dirt]
+    if any(len(cleanliness) != cells for cleanliness in encoded):
+        raise ValueError(f"Cleanliness must have exactly {cells} cells")
+    chars = np.frombuffer(b''.join(encoded), dtype=np.uint8).reshape(-1, cells)
+    if not np.all((chars == ord('c')) | (chars == ord('d'))):
+        raise ValueError("Cleanliness may only contain 'c' and 'd'")
+    weights = np.left_shift(np.int64(1), np.arange(cells - 1, -1, -1, dtype=np.int64))
+    return ((i * n + j) << cells) | ((chars == ord('d')) @ weights)
+
+
+def format_state_string(state):
+    """
+    :param state: Tuple, (i, j, tuple of 'c'/'d').
+    :return: String, the state written as 'm<i>n<j><cleanliness>', e.g. 'm0n1cdd'.
+    """
+    i, j, cleanliness = state
+    return 'm' + str(i) + 'n' + str(j) + ''.join(cleanliness)
+
+
+def parse_state_string(name):
+    """
+    :param name: String, a state written as 'm<i>n<j><cleanliness>'.
+    :return: Tuple, (i, j, tuple of 'c'/'d').
+    """
+    i_text, _, rest = name[1:].partition('n')
+    cleanliness = rest.lstrip('0123456789')
+    j_text = rest[:len(rest) - len(cleanliness)]
+    if not name.startswith('m') or not i_text.isdigit() or not j_text or not set(cleanliness) <= {'c', 'd'}:
+        raise ValueError(f"Invalid state name {name!r}, expected e.g. 'm0n1cdd'")
+    return int(i_text), int(j_text), tuple(cleanliness)
+
+
+class Solution:
+    """
+    A solved grid read from a binary solution file. The value and action arrays
+    are memory-mapped and indexed by packed state id, so opening a file does not
+    read them and each lookup touches a single element.
+    """
+
+    def __init__(self, header, values, policy, states):
+        self.grid = [list(row) for row in header['grid']]
+        self.gamma = header['gamma']
+        self.theta = header['theta']
+        self.actions = header['actions']
+        self.solver = header.get('solver')
+        self.iterations = header.get('iterations')
+        self.values = values
+        self.policy = policy
+        # Sorted packed ids for a reachable-only solution, None when it covers every state
+        self.states = states
+        self._n = len(self.grid[0])
+        self._cells = len(self.grid) * self._n
+
+    @property
+    def state_num(self):
+        return len(self.values)
+
+    def index(self, state):
+        """
+        :param state: Tuple, (i, j, sequence of 'c'/'d').
+        :return: Integer, the position of ``state`` in the value and action arrays.
+        """
+        i, j, cleanliness = state
+        if not (0 <= i < len(self.grid) and 0 <= j < self._n):
+            raise ValueError("Robot position outside the grid")
+        if len(cleanliness) != self._cells or not set(cleanliness) <= {'c', 'd'}:
+            raise ValueError(f"Cleanliness must be {self._cells} cells of 'c' or 'd'")
+        packed = pack_state(state, self._n, self._cells)
+        if self.states is None:
+            return packed
+        index = int(np.searchsorted(self.states, packed))
+        if index == len(self.states) or self.states[index] != packed:
+            raise KeyError(f"{state} is not part of this solution")
+        return index
+
+    @classmethod
+    def from_mdp(cls, mdp, v, policy, solver=None):
+        """
+        Wrap the result of a vacuum.MDP solver without writing it to disk. The
+        results of a model reduced by symmetry are expanded first, so every
+        state it stands for can be looked up.
+
+        :param mdp: vacuum.MDP, the solved model.
+        :param v: Array of values indexed by state.
+        :param policy: Array of action codes indexed by state, -1 for goal states.
+        :param solver: Optional string, the solver that produced the solution.
+        :return: Solution.
+        """
+        header = {'grid': [''.join(row) for row in mdp.grids], 'gamma': mdp.gamma, 'theta': mdp.theta,
+                  'actions': mdp.actions, 'solver': solver}
+        states, v, policy = mdp.unreduced(v, policy)
+        policy = np.asarray(policy)
+        return cls(header, np.asarray(v), np.where(policy < 0, NO_ACTION, policy).astype(np.uint8), states)
+
+    def indices(self, i, j, dirt):
+        """
+        Vectorised :meth:`index`.
+
+        :param i: Sequence of row indices.
+        :param j: Sequence of column indices.
+        :param dirt: Sequence of cleanliness strings, e.g. 'dcdd'.
+        :return: Array of positions in the value and action arrays.
+        """
+        return self.packed_indices(pack_states(i, j, dirt, self._n, self._cells))
+
+    def packed_indices(self, packed):
+        """
+        :param packed: Array of packed state ids.
+        :return: Array of their positions in the value and action arrays.
+        """
+        packed = np.asarray(packed, dtype=np.int64)
+        if self.states is None:
+            return packed
+        indices = np.minimum(np.searchsorted(self.states, packed), len(self.states) - 1)
+        missing = self.states[indices] != packed
+        if missing.any():
+            raise KeyError(f"{unpack_state(packed[missing][0], self._n, self._cells)} is not part of this solution")
+        return indices
+
+    def value(self, state):
+        return float(self.values[self.index(state)])
+
+    def action(self, state):
+        """
+        :return: String, the best action, or None for a goal state.
+        """
+        code = self.policy[self.index(state)]
+        return None if code == NO_ACTION else self.actions[code]
+
+    def state(self, index):
+        packed = index if self.states is None else self.states[index]
+        return unpack_state(packed, self._n, self._cells)
+
+    def blocks(self, chunk_size=1 << 16):
+        """
+        Walk the solution in index order, ``chunk_size`` states at a time, without
+        building the whole key list.
+
+        :param chunk_size: Integer, number of states per block.
+        :return: Generator of (list of state tuples, list of values, list of
+            actions with None for goal states).
+        """
+        for start in range(0, self.state_num, chunk_size):
+            stop = min(start + chunk_size, self.state_num)
+            values = np.asarray(self.values[start:stop], dtype=float).tolist()
+            codes = self.policy[start:stop].tolist()
+            keys = [self.state(index) for index in range(start, stop)]
+            actions = [None if code == NO_ACTION else self.actions[code] for code in codes]
+            # Goal states keep the integer value the text format writes for them
+            values = [int(value) if action is None and value.is_integer() else value
+                      for value, action in zip(values, actions)]
+            yield keys, values, actions
+
+    def as_dicts(self):
+        """
+        :return: Tuple of (value dict, policy dict) keyed by ``(i, j, cleanliness)``
+            tuples, as written by vacuum.save_solution_to_file.
+        """
+        v = {}
+        policy = {}
+        for keys, values, actions in self.blocks():
+            for state, value, action in zip(keys, values, actions):
+                v[state] = value
+                if action is not None:
+                    policy[state] = action
+        return v, policy
+
+
+def _layout(header_size, state_num, value_dtype, subset):
+    """
+    Byte offsets of the arrays following a header of ``header_size`` bytes, each
+    aligned to 64 bytes.
+    """
+    offsets = []
+    offset = header_size
+    for itemsize in (np.dtype(value_dtype).itemsize, 1) + ((8,) if subset else ()):
+        offset = -(-offset // _ALIGNMENT) * _ALIGNMENT
+        offsets.append(offset)
+        offset += itemsize * state_num
+    return offsets, offset
+
+
+def write_solution(filename, grid, values, policy, gamma, theta, actions, states=None, dtype='float64',
+                   solver=None, iterations=None):
+    """
+    Write a binary solution file: a JSON header describing the grid and solver
+    parameters, then the value array, the uint8 action array and, for a
+    reachable-only solution, the sorted packed ids of its states.
+
+    :param filename: String, name of the file.
+    :param grid: List of Lists, the grid configuration.
+    :param values: Array of values indexed by state.
+    :param policy: Array of action codes indexed by state, negative for goal states.
+    :param gamma: Float, the discount factor.
+    :param theta: Float, the convergence threshold.
+    :param actions: List of action names, in action code order.
+    :param states: Optional sorted array of packed ids of the states.
+    :param dtype: String, 'float64' or 'float32' for the stored values.
+    :param solver: Optional string, the solver that produced the solution.
+    :param iterations: Optional integer, the iteration count the solver reported.
+    :return: None
+    """
+    if dtype not in VALUE_DTYPES:
+        raise ValueError(f"Unknown value dtype {dtype!r}, expected one of {VALUE_DTYPES}")
+    header = json.dumps({
+        'grid': [''.join(row) for row in grid], 'gamma': gamma, 'theta': theta, 'actions': list(actions),
+        'solver': solver, 'iterations': iterations, 'dtype': dtype, 'state_num': len(values),
+        'subset': states is not None,
+    }).encode()
+    offsets, size = _layout(len(MAGIC) + 4 + len(header), len(values), dtype, states is not None)
+
+    policy = np.asarray(policy)
+    arrays = [np.asarray(values, dtype=dtype), np.where(policy < 0, NO_ACTION, policy).astype(np.uint8)]
+    if states is not None:
+        arrays.append(np.asarray(states, dtype=np.int64))
+    with open(filename, 'wb') as f:
+        f.write(MAGIC + struct.pack('<I', len(header)) + header)
+        for offset, array in zip(offsets, arrays):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(array.tobytes())
+        f.truncate(size)
+
+
+def save_binary_solution(filename, mdp, v, policy, dtype='float64', solver=None, iterations=None):
+    """
+    Write the result of a vacuum.MDP solver as a binary solution file. The
+    results of a model reduced by symmetry are expanded first, so the file
+    holds every state it stands for.
+
+    :param filename: String, name of the file.
+    :param mdp: vacuum.MDP, the solved model.
+    :param v: Array of values indexed by state.
+    :param policy: Array of action codes indexed by state, -1 for goal states.
+    :param dtype: String, 'float64' or 'float32' for the stored values.
+    :param solver: Optional string, the solver that produced the solution.
+    :param iterations: Optional integer, the iteration count the solver reported.
+    :return: None
+    """
+    states, v, policy = mdp.unreduced(v, policy)
+    write_solution(filename, mdp.grids, v, policy, mdp.gamma, mdp.theta, mdp.actions, states, dtype, solver,
+                   iterations)
+
+
+def load_solution(filename):
+    """
+    Open a binary solution file with its arrays memory-mapped read-only.
+
+    :param filename: String, name of the file.
+    :return: Solution.
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a binary solution file")
+        header_length, = struct.unpack('<I', f.read(4))
+        header = json.loads(f.read(header_length).decode())
+    state_num = header['state_num']
+    offsets, _ = _layout(len(MAGIC) + 4 + header_length, state_num, header['dtype'], header['subset'])
+    values = np.memmap(filename, dtype=header['dtype'], mode='r', offset=offsets[0], shape=(state_num,))
+    policy = np.memmap(filename, dtype=np.uint8, mode='r', offset=offsets[1], shape=(state_num,))
+    states = None
+    if header['subset']:
+        states = np.memmap(filename, dtype=np.int64, mode='r', offset=offsets[2], shape=(state_num,))
+    return Solution(header, values, policy, states)
+
+
+def open_text_solution(filename, mode='r', compression=None):
+    """
+    Open a text solution, compressed or not. When reading, the compression is
+    detected from the first bytes of the file.
+
+    :param filename: String, name of the file.
+    :param mode: String, 'r' or 'w'.
+    :param compression: Optional string, a key of COMPRESSIONS, used when writing.
+    :return: Text file object.
+    """
+    if mode == 'r':
+        with open(filename, 'rb') as f:
+            head = f.read(6)
+        compression = next((name for magic, name in _COMPRESSION_MAGIC if head.startswith(magic)), None)
+    if compression is None:
+        return open(filename, mode)
+    if compression not in COMPRESSIONS:
+        raise ValueError(f"Unknown compression {compression!r}, expected one of {tuple(COMPRESSIONS)}")
+    return _OPENERS[compression](filename, mode + 't')
+
+
+def write_text_solution(filename, blocks, compression=None, sections=True):
+    """
+    Stream a solution into the text format of vacuum.save_solution_to_file one
+    block of states at a time, so that only a block of keys is ever held in
+    memory. The values of every state come first and the actions of the
+    non-goal states after them, so the blocks are walked twice.
+
+    :param filename: String, name of the file.
+    :param blocks: Function returning a fresh iterable of (list of keys, list of
+        values, list of actions with None for goal states) blocks.
+    :param compression: Optional string, a key of COMPRESSIONS.
+    :param sections: Boolean, whether to write the 'value' and 'policy' lines
+        that start the two sections.
+    :return: None
+    """
+    with open_text_solution(filename, 'w', compression) as f:
+        if sections:
+            f.write("value\n")
+        for keys, values, _ in blocks():
+            f.write(''.join(f"{key} {value}\n" for key, value in zip(keys, values)))
+        if sections:
+            f.write("policy\n")
+        for keys, _, actions in blocks():
+            f.write(''.join(f"{key} {action}\n" for key, action in zip(keys, actions) if action is not None))
+
+
+def _parse_key(key):
+    """
+    :param key: String, a state written as an ``(i, j, cleanliness)`` tuple or as
+        a 'm<i>n<j><cleanliness>' name.
+    :return: Tuple, (i, j, tuple of 'c'/'d').
+    """
+    if not key.startswith('('):
+        return parse_state_string(key)
+    # "(0, 1, ('c', 'd'))": the cell letters sit every 5 characters of the inner tuple
+    i_text, j_text, cells_text = key[1:-1].split(', ', 2)
+    return int(i_text), int(j_text), tuple(cells_text[2::5])
+
+
+def iter_text_solution(filename, actions=('up', 'down', 'left', 'right', 'vacuum'), position=None, dirt=None):
+    """
+    Read a text solution (see :func:`read_text_solution`) line by line, keeping
+    only the states at a robot position and / or matching a dirt pattern. Lines
+    of other states are skipped before their value is parsed.
+
+    :param filename: String, name of the file, optionally compressed.
+    :param actions: List of action names, used to tell policy lines from value lines.
+    :param position: Optional (i, j) robot position.
+    :param dirt: Optional string of 'c', 'd' and '?' per cell, '?' matching either.
+    :return: Generator of ('value', state, float) and ('policy', state, action)
+        tuples, states as ``(i, j, cleanliness)`` tuples.
+    """
+    if dirt is not None and not set(dirt) <= {'c', 'd', '?'}:
+        raise ValueError(f"Invalid dirt pattern {dirt!r}, expected 'c', 'd' or '?' per cell")
+    fixed = None if dirt is None else [(k, cell) for k, cell in enumerate(dirt) if cell != '?']
+    position = None if position is None else tuple(position)
+    with open_text_solution(filename) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line in ('value', 'policy'):
+                continue
+            key, token = line.rsplit(' ', 1)
+            i, j, cleanliness = state = _parse_key(key)
+            if position is not None and (i, j) != position:
+                continue
+            if fixed is not None and (len(cleanliness) != len(dirt)
+                                      or any(cleanliness[k] != cell for k, cell in fixed)):
+                continue
+            if token in actions:
+                yield 'policy', state, token
+            else:
+                yield 'value', state, float(token)
+
+
+def read_text_solution(filename, actions=('up', 'down', 'left', 'right', 'vacuum')):
+    """
+    Parse a text solution written by save_solution_to_file in vacuum.py or
+    test.py, with or without the 'value' and 'policy' section lines.
+
+    :param filename: String, name of the file, optionally compressed.
+    :param actions: List of action names, used to tell policy lines from value lines.
+    :return: Tuple of (value dict, policy dict).
+    """
+    v = {}
+    policy = {}
+    for section, state, entry in iter_text_solution(filename, actions):
+        if section == 'policy':
+            policy[state] = entry
+        else:
+            v[state] = entry
+    return v, policy
+
+
+def text_to_binary(text_filename, binary_filename, grid, gamma=0.90, theta=1e-3,
+                   actions=('up', 'down', 'left', 'right', 'vacuum'), dtype='float64'):
+    """
+    Convert a text solution of ``grid`` into a binary solution file.
+
+    :param actions: List of action names of the dynamics the solution was
+        computed with, in action code order, e.g. vacuum.AUTO_CLEAN_DYNAMICS.actions.
+    :return: None
+    """
+    n = len(grid[0])
+    cells = len(grid) * n
+    value_states, values, policy_states, codes = [], [], [], []
+    for section, state, entry in iter_text_solution(text_filename, actions):
+        if section == 'policy':
+            policy_states.append(pack_state(state, n, cells))
+            codes.append(actions.index(entry))
+        else:
+            value_states.append(pack_state(state, n, cells))
+            values.append(entry)
+    states = np.array(value_states, dtype=np.int64)
+    order = np.argsort(states)
+    states = states[order]
+    values = np.array(values)[order]
+    policy = np.full(len(states), -1)
+    policy[np.searchsorted(states, np.array(policy_states, dtype=np.int64))] = codes
+    if np.array_equal(states, np.arange(cells << cells)):
+        states = None
+    write_solution(binary_filename, grid, values, policy, gamma, theta, actions, states, dtype)
+
+
+def binary_to_text(binary_filename, text_filename, compression=None):
+    """
+    Convert a binary solution file into the text format of vacuum.save_solution_to_file.
+
+    :param compression: Optional string, a key of COMPRESSIONS.
+    :return: None
+    """
+    solution = load_solution(binary_filename)
+    write_text_solution(text_filename, solution.blocks, compression)
+
+
+if __name__ == '__main__':
+    # vacuum imports this module, so it is only imported when run as a script
+    from vacuum import DYNAMICS
+
+    parser = argparse.ArgumentParser(description="Convert solutions between the text and binary formats.")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+    to_binary = subparsers.add_parser("to-binary", help="convert a text solution to a binary file")
+    to_binary.add_argument("text_file")
+    to_binary.add_argument("binary_file")
+    to_binary.add_argument("--grid", required=True, help="test case file the solution was computed for")
+    to_binary.add_argument("--gamma", type=float, default=0.90)
+    to_binary.add_argument("--theta", type=float, default=1e-3)
+    to_binary.add_argument("--dtype", choices=VALUE_DTYPES, default="float64")
+    to_binary.add_argument("--dynamics", choices=sorted(DYNAMICS), default="vacuum",
+                           help="dynamics the solution was computed with, which fix its actions")
+    to_text = subparsers.add_parser("to-text", help="convert a binary solution to a text file")
+    to_text.add_argument("binary_file")
+    to_text.add_argument("text_file")
+    to_text.add_argument("--compress", choices=sorted(COMPRESSIONS), help="compress the text file")
+    query = subparsers.add_parser("query", help="print the lines of a text solution for some states")
+    query.add_argument("text_file")
+    query.add_argument("--position", nargs=2, type=int, metavar=("I", "J"), help="robot position to keep")
+    query.add_argument("--dirt", help="cleanliness pattern to keep, '?' matching either, e.g. d??c")
+    args = parser.parse_args()
+
+    if args.command == "to-binary":
+        with open(args.grid, 'r') as f:
+            grid = [list(line.strip()) for line in f.readlines()]
+        text_to_binary(args.text_file, args.binary_file, grid, args.gamma, args.theta,
+                       DYNAMICS[args.dynamics].actions, args.dtype)
+    elif args.command == "to-text":
+        binary_to_text(args.binary_file, args.text_file, args.compress)
+    else:
+        for section, state, entry in iter_text_solution(args.text_file, position=args.position, dirt=args.dirt):
+            print(section, state, entry)
@@ -1,7 +1,13 @@
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import importlib.util
 import os
 import time
 
-from vacuum import MDP
+from batch import BatchMDP, group_by_shape
+from solution_cache import DEFAULT_CACHE_DIR, SolutionCache
+from vacuum import MDP, SOLVERS, save_solution_stream
 
 
 def read_grid_from_file(filename):
@@ -15,71 +21,229 @@ def read_grid_from_file(filename):
         return [list(line.strip()) for line in lines]
 
 
-def save_solution_to_file(filename, v, policy):
+def run_value_iteration_for_file(filepath:str):
     """
 
-    :param filename:
-    :param v:
-    :param policy:
+    :param filepath:
     :return:
     """
-    with open(filename, 'w') as f:
-        for key in v:
-            f.write(f"{key} {v[key]}\n")
-        for key in policy:
-            f.write(f"{key} {policy[key]}\n")
+    return run_solver_for_file(filepath, 'value_iteration')
 
 
-def run_value_iteration_for_file(filepath:str):
+def _solve_file(filepath, solver, cache=None):
     """
+    Only exact cache hits are reused: a warm start from another solver's
+    solution would make the solvers' times and iteration counts meaningless.
 
-    :param filepath:
-    :return:
+    :return: Tuple of (MDP, value array, policy array, iterations, elapsed time).
     """
-    grids = read_grid_from_file(filepath)
-    mdp = MDP(grids)
-    state_num = mdp.state_num
-    m = len(grids)
-    n = len(grids[0])
-
+    mdp = MDP(read_grid_from_file(filepath))
     start_time = time.time()
-    v, policy, num_iterations = mdp.value_iteration()
+    if cache is not None:
+        v, policy, num_iterations = SolutionCache(cache, warm_start=False).solve(mdp, solver)
+    else:
+        v, policy, num_iterations = mdp.solve(solver)
     end_time = time.time()
+    return mdp, v, policy, num_iterations, end_time - start_time
+
+
+def run_solver_for_file(filepath:str, solver:str, cache=None):
+    """
+    Solve one test case with the given solver.
 
-    elapsed_time = end_time - start_time
+    :param filepath: String, path of the test case.
+    :param solver: String, one of vacuum.SOLVERS.
+    :param cache: Optional folder of a solution_cache.SolutionCache to reuse.
+    :return: Tuple of (m, n, number of states, iterations, number of policies,
+        elapsed time, value dict, policy dict).
+    """
+    mdp, v, policy, num_iterations, elapsed_time = _solve_file(filepath, solver, cache)
+    m = len(mdp.grids)
+    n = len(mdp.grids[0])
+    v, policy = mdp.as_dicts(v, policy)
     num_policies = len(policy)
 
-    return m, n, state_num, num_iterations, num_policies, elapsed_time, v, policy
+    return m, n, mdp.state_num, num_iterations, num_policies, elapsed_time, v, policy
+
+
+def solve_test_case(test_folder, filename, solvers, cache=None):
+    """
+    Run every solver on one test case and save the solution of the first one,
+    streamed from the solver's arrays rather than expanded into dictionaries.
+
+    :param test_folder: String, folder holding the test case.
+    :param filename: String, name of the test case file.
+    :param solvers: List of solver names.
+    :param cache: Optional folder of a solution_cache.SolutionCache to reuse.
+    :return: Tuple of (m, n, number of states, number of policies, list of
+        (iterations, backups, elapsed time) per solver).
+    """
+    filepath = os.path.join(test_folder, filename)
+    solver_results = []
+    for solver in solvers:
+        mdp, v, policy, num_iterations, elapsed_time = _solve_file(filepath, solver, cache)
+        if not solver_results:
+            solution_filename = filename.replace("test_case", "solution")
+            solution_filepath = os.path.join(test_folder, solution_filename)
+            save_solution_stream(solution_filepath, mdp, v, policy, sections=False)
+        solver_results.append((num_iterations, mdp.backups, elapsed_time))
+    num_policies = int((policy >= 0).sum())
+    return len(mdp.grids), len(mdp.grids[0]), mdp.state_num, num_policies, solver_results
+
+
+def _solve_test_case_in_child(test_folder, filename, solvers, memory_limit, cache, connection):
+    if memory_limit is not None:
+        # Only Unix has the resource module, so it is not needed otherwise
+        import resource
+        limit = memory_limit * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    try:
+        connection.send(('ok', solve_test_case(test_folder, filename, solvers, cache)))
+    except MemoryError:
+        connection.send(('memory limit', None))
+    except Exception as e:
+        connection.send(('error', repr(e)))
+
+
+def run_batch(test_folder, filenames, solvers, jobs=1, timeout=None, memory_limit=None, cache=None):
+    """
+    Solve test cases concurrently, one child process per case, and yield each
+    result as soon as its case finishes.
+
+    :param test_folder: String, folder holding the test cases.
+    :param filenames: List of test case file names, started in this order.
+    :param solvers: List of solver names.
+    :param jobs: Integer, number of cases solved at the same time.
+    :param timeout: Optional number of seconds after which a case is killed.
+    :param memory_limit: Optional address space limit of each case, in MB.
+    :param cache: Optional folder of a solution_cache.SolutionCache to reuse.
+    :return: Generator of (filename, status, result) where result is the return
+        value of :func:`solve_test_case` when status is 'ok'.
+    """
+    pending = list(filenames)
+    running = {}
+    while pending or running:
+        while pending and len(running) < jobs:
+            filename = pending.pop(0)
+            receiver, sender = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_solve_test_case_in_child,
+                                              args=(test_folder, filename, solvers, memory_limit, cache, sender))
+            process.start()
+            sender.close()
+            running[receiver] = (process, filename, time.time())
+
+        wait_time = None
+        if timeout is not None:
+            wait_time = max(0, min(start + timeout for _, _, start in running.values()) - time.time())
+        for receiver in multiprocessing.connection.wait(list(running), wait_time):
+            process, filename, _ = running.pop(receiver)
+            try:
+                status, result = receiver.recv()
+            except EOFError:
+                status, result = 'crashed', None
+            process.join()
+            yield filename, status, result
+
+        if timeout is not None:
+            for receiver, (process, filename, start) in list(running.items()):
+                if time.time() - start > timeout:
+                    process.terminate()
+                    process.join()
+                    del running[receiver]
+                    yield filename, 'timeout', None
+
+
+def run_batched(test_folder, filenames, batch_size=64):
+    """
+    Solve test cases with value iteration, batching those of the same shape
+    into one batch.BatchMDP of up to ``batch_size`` grids, and save the
+    solution of each. The elapsed time of a case is its share of its batch.
+
+    :param test_folder: String, folder holding the test cases.
+    :param filenames: List of test case file names.
+    :param batch_size: Integer, largest number of cases solved together.
+    :return: Generator of (filename, status, result) as :func:`run_batch` yields
+        them for the single solver 'value_iteration'.
+    """
+    grids_list = [read_grid_from_file(os.path.join(test_folder, filename)) for filename in filenames]
+    for (m, n), members in group_by_shape(grids_list).items():
+        for start in range(0, len(members), batch_size):
+            chunk = members[start:start + batch_size]
+            start_time = time.time()
+            batch = BatchMDP([grids_list[k] for k in chunk])
+            v, policy, iterations = batch.solve()
+            elapsed_time = (time.time() - start_time) / len(chunk)
+            for row, k in enumerate(chunk):
+                solution_filename = filenames[k].replace("test_case", "solution")
+                save_solution_stream(os.path.join(test_folder, solution_filename), batch.template, v[row],
+                                     policy[row], sections=False)
+                num_policies = int((policy[row] >= 0).sum())
+                # Every sweep backs up each non-goal state, those with a policy
+                backups = int(iterations[row]) * num_policies
+                yield filenames[k], 'ok', (m, n, batch.state_num, num_policies,
+                                           [(int(iterations[row]), backups, elapsed_time)])
 
 
 if __name__ == '__main__':
-    results = []
+    parser = argparse.ArgumentParser(description="Solve every test case and compare solvers side by side.")
+    parser.add_argument("--solvers", nargs="+", choices=SOLVERS, default=['value_iteration'],
+                        help="solvers to run; the solution file is written from the first one")
+    parser.add_argument("--compare", action="store_true",
+                        help="run every solver side by side, the same as listing them all in --solvers")
+    parser.add_argument("--jobs", type=int, default=1, help="number of test cases solved concurrently")
+    parser.add_argument("--timeout", type=float, help="seconds after which a test case is abandoned")
+    parser.add_argument("--memory-limit", type=int, help="memory limit of each test case, in MB")
+    parser.add_argument("--cache", nargs="?", const=DEFAULT_CACHE_DIR,
+                        help=f"reuse and store solutions in this folder (default {DEFAULT_CACHE_DIR}); "
+                             "only exact hits are reused, solvers never warm-start from each other")
+    parser.add_argument("--batch", nargs="?", type=int, const=64, metavar="SIZE",
+                        help="solve test cases of the same shape together with value iteration, up to SIZE at a "
+                             "time (default 64), in this process; --solvers, --jobs, --timeout, --memory-limit and "
+                             "--cache do not apply")
+    args = parser.parse_args()
+    if args.memory_limit is not None and importlib.util.find_spec('resource') is None:
+        parser.error("--memory-limit needs the Unix resource module, which this platform does not have")
+    solvers = ['value_iteration'] if args.batch else list(SOLVERS) if args.compare else args.solvers
+
     test_folder = "test"
 
     test_files = [f for f in os.listdir(test_folder) if f.startswith("test_case_")]
     sorted_test_files = sorted(test_files, key=lambda x: int(x.split('_')[2]))
 
-    # Travel through all the test case in the test folder and return test result
-    for filename in sorted_test_files:
-        filepath = os.path.join(test_folder, filename)
-        m, n, state_num, num_iterations, num_policies, elapsed_time, v, policy = run_value_iteration_for_file(filepath)
-
-        solution_filename = filename.replace("test_case", "solution")
-        solution_filepath = os.path.join(test_folder, solution_filename)
-        save_solution_to_file(solution_filepath, v, policy)
-
-        results.append((filename, m, n, num_iterations, num_policies, elapsed_time))
-
-        print(f"Processed {filename}:")
-        print(f"  Grid Dimensions: {m}x{n}")
-        print(f"  Number of States: {state_num}")
-        print(f"  Number of Iterations: {num_iterations}")
-        print(f"  Number of Policies: {num_policies}")
-        print(f"  Elapsed Time: {elapsed_time:.2f} seconds")
-        print("-" * 50)
-
-    # Save results to a table (e.g., CSV format)
+    # Save results to a table (e.g., CSV format), one row as soon as each test case finishes
     with open("results_table.csv", 'w') as f:
-        f.write("Filename,m,n,Num Iterations,Num Policies,Elapsed Time\n")
-        for row in results:
-            f.write(",".join(map(str, row)) + "\n")
+        columns = [f"{solver} {column}" for solver in solvers for column in ("Iterations", "Backups", "Elapsed Time")]
+        f.write(",".join(["Filename", "m", "n", "Num States", "Num Policies"] + columns + ["Status"]) + "\n")
+        f.flush()
+
+        # Travel through all the test case in the test folder and return test result
+        if args.batch:
+            results = run_batched(test_folder, sorted_test_files, args.batch)
+        else:
+            results = run_batch(test_folder, sorted_test_files, solvers, args.jobs, args.timeout,
+                                args.memory_limit, args.cache)
+        for filename, status, result in results:
+            if status != 'ok':
+                print(f"Failed {filename}: {status}" + (f" ({result})" if result else ""))
+                print("-" * 70)
+                row = [filename] + [""] * (4 + len(columns)) + [status]
+                f.write(",".join(row) + "\n")
+                f.flush()
+                continue
+
+            m, n, state_num, num_policies, solver_results = result
+            print(f"Processed {filename}:")
+            print(f"  Grid Dimensions: {m}x{n}")
+            print(f"  Number of States: {state_num}")
+            print(f"  Number of Policies: {num_policies}")
+            # Iterations are sweeps for most solvers but backup steps for
+            # prioritized sweeping and per-layer sweeps for layered, so backups
+            # are the count to compare across solvers
+            print(f"  {'Solver':<28}{'Iterations':>12}{'Backups':>12}{'Elapsed Time':>16}")
+            for solver, (num_iterations, backups, elapsed_time) in zip(solvers, solver_results):
+                print(f"  {solver:<28}{num_iterations:>12}{backups:>12}{elapsed_time:>14.2f} s")
+            print("-" * 70)
+
+            row = [filename, m, n, state_num, num_policies] + [value for values in solver_results for value in values]
+            f.write(",".join(map(str, row + [status])) + "\n")
+            f.flush()
@@ -0,0 +1,21 @@
+from batch import BatchMDP, random_grids
+from vacuum import MDP
+
+
+def test_sweep_stats_match_single_grid_solves():
+    grids_list = random_grids(2, 3, 3, seed=1)
+    batch = BatchMDP(grids_list)
+    batch_stats = []
+    batch.callback = batch_stats.append
+    batch.solve()
+    single_stats = []
+    for grids in grids_list:
+        mdp = MDP(grids)
+        single_stats.append([])
+        mdp.callback = single_stats[-1].append
+        mdp.solve()
+    for sweep, stats in enumerate(batch_stats):
+        # Grids leave the batch once converged
+        running = [grid_stats[sweep] for grid_stats in single_stats if sweep < len(grid_stats)]
+        assert stats.policy_changes == sum(grid.policy_changes for grid in running)
+        assert stats.backups == sum(grid.backups for grid in running)
@@ -0,0 +1,31 @@
+import numpy as np
+
+from solution_cache import SolutionCache
+from solution_file import Solution, load_solution, pack_state, save_binary_solution
+from vacuum import MDP
+
+GRID = [['v', 'v'], ['v', 'v']]
+
+
+def test_reduced_solution_round_trip(tmp_path):
+    full = MDP(GRID)
+    full_v, _, _ = full.solve()
+    for start_states in (None, [(0, 0, tuple('dddd'))]):
+        reduced = MDP(GRID, start_states, symmetry=True)
+        v, policy, _ = reduced.solve()
+        path = tmp_path / 'solution.bin'
+        save_binary_solution(path, reduced, v, policy)
+        state = (1, 1, tuple('dddc'))
+        assert pack_state(state, 2, 4) not in reduced.reachable_states
+        for solution in (load_solution(path), Solution.from_mdp(reduced, v, policy)):
+            assert abs(solution.value(state) - full_v[full.encode(state)]) < full.theta / (1 - full.gamma)
+            assert solution.action(state) in full.actions
+
+
+def test_cached_reduced_solution_is_reused(tmp_path):
+    reduced = MDP(GRID, symmetry=True)
+    v, policy, _ = SolutionCache(tmp_path).solve(reduced)
+    again = MDP(GRID, symmetry=True)
+    cached_v, cached_policy, _ = SolutionCache(tmp_path).solve(again)
+    assert np.array_equal(cached_v, v)
+    assert np.array_equal(cached_policy, policy)
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from vacuum import MDP, SOLVERS
+
+GRID = [['v', 't']]
+
+
+def test_parallel_value_iteration_with_more_workers_than_states():
+    serial = MDP(GRID)
+    v, policy, iterations = serial.value_iteration()
+    parallel = MDP(GRID)
+    v_parallel, policy_parallel, iterations_parallel = parallel.value_iteration(workers=4 * parallel.state_num)
+    assert iterations_parallel == iterations
+    assert np.array_equal(v_parallel, v)
+    assert np.array_equal(policy_parallel, policy)
+
+
+def test_encode_rejects_positions_outside_the_grid():
+    mdp = MDP(GRID)
+    for state in [(3, 0, ('c', 'd')), (0, 2, ('c', 'd')), (-1, 0, ('c', 'd'))]:
+        with pytest.raises(KeyError):
+            mdp.encode(state)
+    with pytest.raises(KeyError):
+        MDP(GRID, start_states=[(9, 9, ('d', 'c'))])
+
+
+def test_float32_solvers_report_the_float64_residual_bound():
+    for solver in SOLVERS:
+        mdp = MDP([['v', 't'], ['T', 'v']], dtype='float32')
+        mdp.solve(solver)
+        assert mdp.V.dtype == np.float32
+        assert mdp.error_bound == pytest.approx(2 * mdp.gamma * mdp.bellman_residual() / (1 - mdp.gamma))
@@ -1,34 +1,439 @@
-import sys
-from itertools import product
+import argparse
+import multiprocessing
+import time
+from collections import namedtuple
 import numpy as np
 
+try:
+    from scipy import sparse
+    from scipy.sparse.linalg import spsolve
+except ImportError:
+    sparse = None
+
+from solution_cache import DEFAULT_CACHE_DIR, SolutionCache
+from solution_file import (COMPRESSIONS, format_state_string, pack_state, parse_state_string, save_binary_solution,
+                           unpack_masks, unpack_state, write_text_solution)
+
+CLEANING_SUCCESS_PROBABILITY = {'v': 0.95, 't': 0.85, 'T': 0.75}
+MOVES = ('up', 'down', 'left', 'right')
+BACKENDS = ('loop', 'numpy')
+SOLVERS = ('value_iteration', 'gauss_seidel', 'prioritized_sweeping', 'policy_iteration',
+           'modified_policy_iteration', 'layered', 'chunked')
+VALUE_DTYPES = ('float64', 'float32')
+EVALUATIONS = ('direct', 'iterative')
+# Maps of the grid onto itself tried by MDP(symmetry=True), each as (transpose,
+# flip rows, flip columns) applied in that order; rotations are counter-clockwise
+# and the transposing maps need a square grid
+SYMMETRIES = {'flip_vertical': (False, True, False), 'flip_horizontal': (False, False, True),
+              'rotate_180': (False, True, True), 'transpose': (True, False, False),
+              'rotate_90': (True, True, False), 'rotate_270': (True, False, True),
+              'anti_transpose': (True, True, True)}
+# Parts of a value iteration backup timed when MDP.profile is set
+PROFILE_PHASES = ('transition', 'reward', 'max')
+
+StateBlock = namedtuple('StateBlock', ['states', 'entries', 'starts'])
+# What MDP.callback receives after every sweep: the largest value change, the
+# sweep's wall time in seconds, its number of backups and the number of states
+# whose greedy action changed
+SweepStats = namedtuple('SweepStats', ['iteration', 'delta', 'time', 'backups', 'policy_changes'])
+
+# Declarative rules of a vacuum world. With ``clean_on_entry`` the robot tries to
+# clean every cell it moves into; otherwise it cleans its own cell with the
+# 'vacuum' action. ``rewards`` maps outcome kinds to rewards:
+#   bump  - moving into a wall, the robot stays put
+#   move  - moving; with clean_on_entry, landing on a clean cell from a clean cell
+#   clean - cleaning a dirty cell; with clean_on_entry, landing on a clean cell
+#           from a dirty cell
+#   fail  - a dirty cell stays dirty
+#   idle  - vacuuming an already clean cell
+Dynamics = namedtuple('Dynamics', ['name', 'actions', 'clean_on_entry', 'success_probability', 'rewards'])
+
+VACUUM_DYNAMICS = Dynamics('vacuum', MOVES + ('vacuum',), False, CLEANING_SUCCESS_PROBABILITY,
+                           {'bump': -5, 'move': -1, 'clean': 10, 'fail': -1, 'idle': -5})
+AUTO_CLEAN_DYNAMICS = Dynamics('auto_clean', MOVES, True, CLEANING_SUCCESS_PROBABILITY,
+                               {'bump': -5, 'move': -1, 'clean': 5, 'fail': -3})
+DYNAMICS = {dynamics.name: dynamics for dynamics in (VACUUM_DYNAMICS, AUTO_CLEAN_DYNAMICS)}
+# Value of the goal states, where every cell is clean
+GOAL_VALUE = 100
+# Largest grid whose dirt masks fit the uint64 masks transition_outcomes accepts
+MAX_CELLS = 64
+
 
 class MDP:
-    def __init__(self, _grids):
+    def __init__(self, _grids, start_states=None, dynamics=VACUUM_DYNAMICS, dtype='float64', symmetry=False):
         """
+        States are packed into a single integer index ``pos * 2**(m*n) + mask``,
+        where ``pos = i * n + j`` and bit ``m*n - 1 - k`` of ``mask`` is set when
+        cell ``k`` is dirty. This keeps the same ordering as
+        ``product(range(m), range(n), product('cd', repeat=m*n))`` so the value
+        function and policy can live in flat arrays.
 
-        :param _grids:
+        When ``start_states`` is given, the state space is only the states
+        reachable from them, found by forward exploration. States are then
+        numbered by their position in that sorted set.
+
+        With ``dtype='float32'`` the value function takes half the memory. Backups
+        discount successor values in float32 and add rewards in float64, and
+        are rounded to float32 when stored; :meth:`solve` then measures how far
+        the result is from the float64 fixed point in ``error_bound``.
+
+        With ``symmetry=True``, the maps of SYMMETRIES that carry every cell onto
+        a cell of the same type are found, and the model only holds the smallest
+        packed id of every orbit of states under them. Successors are replaced by
+        their representative, so the values are those of the full model while
+        state counts shrink by up to the number of maps found plus one.
+        :meth:`expand` maps results back onto every state.
+
+        :param _grids: List of Lists, the grid configuration.
+        :param start_states: Optional list of (i, j, cleanliness) states.
+        :param dynamics: Dynamics, the action set and transition/reward rules.
+        :param dtype: String, one of VALUE_DTYPES, the storage type of ``V``.
+        :param symmetry: Boolean, whether to solve over orbit representatives.
         """
+        if dtype not in VALUE_DTYPES:
+            raise ValueError(f"Unknown value dtype {dtype!r}, expected one of {VALUE_DTYPES}")
         self._grids = _grids
         self._m = len(_grids)
         self._n = len(_grids[0])
+        self._cells = self._m * self._n
+        self._masks = 1 << self._cells
 
-        self._states = list(product(range(self._m), range(self._n), product('cd', repeat=self._m * self._n)))
-        self._goalStates = list(product(range(self._m), range(self._n), product('c', repeat=self._m * self._n)))
-
-        self._actions = ['up', 'down', 'left', 'right', 'vacuum']
+        self.dynamics = dynamics
+        self._actions = list(dynamics.actions)
+        # (name, cell each cell maps to, action code each action code maps to)
+        # of the grid symmetries the model is reduced by
+        self._symmetries = self._find_symmetries() if symmetry else []
+        # Packed ids of the states in this model, None when it covers all of them
+        self._states = None
+        self._from_start_states = start_states is not None
+        if start_states is not None:
+            self._states = self._explore(self._canonical(np.array([self._pack(state) for state in start_states],
+                                                                  dtype=np.int64))[0])
+        elif self._symmetries:
+            self._states = self._representatives()
         self.gamma = 0.90
         self.theta = 1e-3
-        self.V = {}
-        for state in self._states:
-            if state[:2] + (tuple(state[2]),) in self._goalStates:
-                self.V[state] = 100
-            else:
-                self.V[state] = 0
+        self.V = np.zeros(self.state_num, dtype=dtype)
+        self.V[self._goal_indices()] = GOAL_VALUE
+        self.backups = 0
+        # Optional function called with a SweepStats after every sweep
+        self.callback = None
+        # When set, value iteration adds the seconds spent in each of
+        # PROFILE_PHASES to timings
+        self.profile = False
+        self.timings = dict.fromkeys(PROFILE_PHASES, 0.0)
+        # Why the last value iteration stopped, and the bound on how far the
+        # value of its policy can be from optimal
+        self.stop_reason = None
+        self.error_bound = None
+        self._model = None
 
     @property
     def state_num(self):
-        return len(self._states)
+        if self._states is not None:
+            return len(self._states)
+        return self._cells * self._masks
+
+    @property
+    def grids(self):
+        return self._grids
+
+    @property
+    def actions(self):
+        return list(self._actions)
+
+    @property
+    def symmetries(self):
+        """
+        :return: List of the names of the SYMMETRIES the model is reduced by.
+        """
+        return [name for name, _, _ in self._symmetries]
+
+    @property
+    def reachable_states(self):
+        """
+        :return: Sorted array of the packed ids of the states of a model built
+            from start states or reduced by symmetry, or None when the model
+            covers every state.
+        """
+        return self._states
+
+    def encode(self, state):
+        """
+        Pack an ``(i, j, cleanliness)`` state into its integer index.
+
+        :param state: Tuple, (i, j, tuple of 'c'/'d').
+        :return: Integer, the state index.
+        """
+        packed = self._pack(state)
+        if self._symmetries:
+            # A model reduced by symmetry answers for the state's representative
+            packed = int(self._canonical(np.array([packed], dtype=np.int64))[0][0])
+        if self._states is None:
+            return packed
+        index = int(np.searchsorted(self._states, packed))
+        if index == len(self._states) or self._states[index] != packed:
+            raise KeyError(f"{state} is not reachable from the start states")
+        return index
+
+    def decode(self, index):
+        """
+        Unpack an integer index into its ``(i, j, cleanliness)`` state.
+
+        :param index: Integer, the state index.
+        :return: Tuple, (i, j, tuple of 'c'/'d').
+        """
+        return unpack_state(self._packed(index), self._n, self._cells)
+
+    def is_goal(self, index):
+        """
+        A state is a goal when every cell is clean, i.e. its dirt mask is 0.
+
+        :param index: Integer, the state index.
+        :return: Boolean.
+        """
+        return self._packed(index) % self._masks == 0
+
+    def _pack(self, state):
+        i, j, cleanliness = state
+        if not (0 <= i < self._m and 0 <= j < self._n) or len(cleanliness) != self._cells or \
+                not set(cleanliness) <= {'c', 'd'}:
+            raise KeyError(f"{state} is not a state of this grid")
+        return pack_state(state, self._n, self._cells)
+
+    def _packed(self, index):
+        return index if self._states is None else self._states[index]
+
+    def _packed_states(self):
+        """
+        :return: Array with the packed id of every state index of this model.
+        """
+        if self._states is None:
+            return np.arange(self.state_num, dtype=np.int64)
+        return self._states
+
+    def _goal_indices(self):
+        if self._states is None:
+            return np.arange(self._cells) * self._masks
+        return np.flatnonzero(self._states % self._masks == 0)
+
+    def _explore(self, start):
+        """
+        Breadth-first search over the transition model.
+
+        :param start: List of packed state ids.
+        :return: Sorted array of the packed ids reachable from ``start``.
+        """
+        seen = np.unique(np.asarray(start, dtype=np.int64))
+        frontier = seen
+        while len(frontier):
+            successors = np.concatenate([self._canonical(self._outcomes(frontier, action)[0].ravel())[0]
+                                         for action in self._actions])
+            frontier = np.setdiff1d(successors, seen)
+            seen = np.union1d(seen, frontier)
+        return seen
+
+    def _find_symmetries(self):
+        """
+        :return: List of (name, cell each cell maps to, action code each action
+            code maps to) for every map of SYMMETRIES that keeps every cell type.
+        """
+        deltas = {'up': (-1, 0), 'down': (1, 0), 'left': (0, -1), 'right': (0, 1)}
+        symmetries = []
+        for name, (transpose, flip_rows, flip_columns) in SYMMETRIES.items():
+            if transpose and self._m != self._n:
+                continue
+
+            def image(i, j):
+                if transpose:
+                    i, j = j, i
+                return self._m - 1 - i if flip_rows else i, self._n - 1 - j if flip_columns else j
+
+            cells = np.array([image(i, j)[0] * self._n + image(i, j)[1]
+                              for i in range(self._m) for j in range(self._n)])
+            # Flipping a single row or column moves nothing, and on such grids
+            # several maps move the cells the same way
+            if any(np.array_equal(cells, other) for other in [np.arange(self._cells)] +
+                   [other for _, other, _ in symmetries]):
+                continue
+            if any(self._grids[k // self._n][k % self._n] != self._grids[c // self._n][c % self._n]
+                   for k, c in enumerate(cells.tolist())):
+                continue
+            codes = []
+            for action in self._actions:
+                if action not in deltas:
+                    codes.append(self._actions.index(action))
+                    continue
+                # Move the origin by the action's displacement and see where the map sends it
+                di, dj = deltas[action]
+                (i0, j0), (i1, j1) = image(0, 0), image(di, dj)
+                codes.append(self._actions.index(next(move for move, delta in deltas.items()
+                                                      if delta == (i1 - i0, j1 - j0))))
+            symmetries.append((name, cells, np.array(codes)))
+        return symmetries
+
+    def _canonical(self, packed):
+        """
+        :param packed: Array of packed state ids.
+        :return: Tuple of (array of the smallest packed id in the orbit of each
+            state, array of the 1-based position in ``_symmetries`` of the map
+            that gives it, 0 when the state is its own representative).
+        """
+        canonical = packed
+        symmetry = np.zeros(len(packed), dtype=np.int8)
+        for code, (_, cells, _) in enumerate(self._symmetries, 1):
+            image = self._image(packed, cells)
+            smaller = image < canonical
+            canonical = np.where(smaller, image, canonical)
+            symmetry[smaller] = code
+        return canonical, symmetry
+
+    def _image(self, packed, cells):
+        """
+        :param packed: Array of packed state ids.
+        :param cells: Array, the cell each cell maps to.
+        :return: Array of the packed ids the map sends the states to.
+        """
+        pos, mask = np.divmod(packed, self._masks)
+        image_mask = np.zeros_like(mask)
+        for k, c in enumerate(cells.tolist()):
+            image_mask |= ((mask >> (self._cells - 1 - k)) & 1) << (self._cells - 1 - c)
+        return cells[pos] * self._masks + image_mask
+
+    def _representatives(self, chunk_size=1 << 20):
+        """
+        :return: Sorted array of the packed ids that are the smallest of their orbit.
+        """
+        total = self._cells * self._masks
+        representatives = []
+        for start in range(0, total, chunk_size):
+            packed = np.arange(start, min(start + chunk_size, total))
+            representatives.append(packed[self._canonical(packed)[0] == packed])
+        return np.concatenate(representatives)
+
+    def _indices(self, packed):
+        """
+        :param packed: Array of packed ids of states of this model or, when it is
+            reduced by symmetry, of states in the orbit of one.
+        :return: Array of their state indices.
+        """
+        packed = self._canonical(packed)[0]
+        if self._states is None:
+            return packed
+        return np.searchsorted(self._states, packed)
+
+    def expand(self, v, policy, states=None, chunk_size=1 << 20):
+        """
+        Map the results of a model reduced by symmetry back onto unreduced
+        states: a state takes the value of its representative, and the
+        representative's action carried back through the map between them.
+
+        :param v: Array of values indexed by state.
+        :param policy: Array of action codes indexed by state, -1 for goal states.
+        :param states: Optional sorted array of packed ids to expand onto, e.g.
+            the reachable_states of the same grid built without symmetry;
+            default every state of the grid.
+        :param chunk_size: Integer, number of states mapped at once.
+        :return: Tuple of (value array, policy array) indexed like ``states``.
+        """
+        total = self._cells * self._masks if states is None else len(states)
+        # Row s + 1 sends an action code at a representative to the code at a
+        # state the map s sends onto it; the last column keeps -1 for goal states
+        inverse = np.full((len(self._symmetries) + 1, len(self._actions) + 1), -1, dtype=np.int8)
+        inverse[0, :-1] = np.arange(len(self._actions))
+        for row, (_, _, codes) in enumerate(self._symmetries, 1):
+            inverse[row, codes] = np.arange(len(self._actions))
+        expanded_v = np.empty(total, dtype=np.asarray(v).dtype)
+        expanded_policy = np.empty(total, dtype=np.int8)
+        for start in range(0, total, chunk_size):
+            stop = min(start + chunk_size, total)
+            packed = np.arange(start, stop) if states is None else np.asarray(states[start:stop], dtype=np.int64)
+            canonical, symmetry = self._canonical(packed)
+            indices = canonical
+            if self._states is not None:
+                indices = np.minimum(np.searchsorted(self._states, canonical), len(self._states) - 1)
+                if np.any(self._states[indices] != canonical):
+                    raise KeyError("Some states are not in the orbit of a state of this model")
+            expanded_v[start:stop] = v[indices]
+            expanded_policy[start:stop] = inverse[symmetry, policy[indices]]
+        return expanded_v, expanded_policy
+
+    def unreduced(self, v, policy):
+        """
+        Results over the states they describe, for writing them out. Those of a
+        model reduced by symmetry are expanded with :meth:`expand` onto every
+        state, or onto every state in the orbit of one of its states when it
+        was built from start states.
+
+        :param v: Array of values indexed by state.
+        :param policy: Array of action codes indexed by state, -1 for goal states.
+        :return: Tuple of (sorted array of the packed ids of the states, None
+            when they are all of them, value array, policy array).
+        """
+        if not self._symmetries:
+            return self._states, v, policy
+        states = None
+        if self._from_start_states:
+            states = np.unique(np.concatenate([self._states] + [self._image(self._states, cells)
+                                                                for _, cells, _ in self._symmetries]))
+        return (states,) + self.expand(v, policy, states)
+
+    def state_key(self, state):
+        """
+        :param state: Tuple, (i, j, tuple of 'c'/'d').
+        :return: The key of ``state`` in :meth:`as_dicts`, the tuple itself here.
+        """
+        return state
+
+    def state_keys(self, start=0, stop=None):
+        """
+        :param start: Integer, first state index.
+        :param stop: Optional integer, state index to stop before, default the last.
+        :return: List with the :meth:`state_key` of every state index in the range.
+        """
+        stop = self.state_num if stop is None else stop
+        packed = self._packed_states()[start:stop] if self._states is not None else np.arange(start, stop)
+        pos, mask = np.divmod(packed, self._masks)
+        i, j = np.divmod(pos, self._n)
+        return [self.state_key((row, column, cleanliness))
+                for row, column, cleanliness in zip(i.tolist(), j.tolist(), unpack_masks(mask, self._cells))]
+
+    def solution_blocks(self, v, policy, chunk_size=1 << 16):
+        """
+        Walk array results in state order, ``chunk_size`` states at a time, so
+        that only one block of keys is built at once.
+
+        :param v: Array of values indexed by state.
+        :param policy: Array of action codes indexed by state, -1 for goal states.
+        :param chunk_size: Integer, number of states per block.
+        :return: Generator of (list of keys, list of values, list of actions with
+            None for goal states), as :meth:`as_dicts` would hold them.
+        """
+        for start in range(0, self.state_num, chunk_size):
+            stop = min(start + chunk_size, self.state_num)
+            packed = self._states[start:stop] if self._states is not None else np.arange(start, stop)
+            goal = packed % self._masks == 0
+            values = np.asarray(v[start:stop], dtype=float).tolist()
+            codes = np.asarray(policy[start:stop]).tolist()
+            actions = [None if is_goal else self._actions[code] for is_goal, code in zip(goal.tolist(), codes)]
+            values = [GOAL_VALUE if action is None else value for value, action in zip(values, actions)]
+            yield self.state_keys(start, stop), values, actions
+
+    def as_dicts(self, v, policy):
+        """
+        Expand array results into the tuple-keyed dictionaries used before the
+        packed encoding, in the same order and with the same values.
+
+        :param v: Array of values indexed by state.
+        :param policy: Array of action codes indexed by state, -1 for goal states.
+        :return: Tuple of (value dict, policy dict).
+        """
+        v_dict = {}
+        policy_dict = {}
+        for keys, values, actions in self.solution_blocks(v, policy):
+            v_dict.update(zip(keys, values))
+            policy_dict.update((key, action) for key, action in zip(keys, actions) if action is not None)
+        return v_dict, policy_dict
 
     def transition(self, state, action):
         i, j, cleanliness = state
@@ -43,15 +448,13 @@ class MDP:
 
         result_states = {(i, j, cleanliness): 1.0}
 
-        if action == 'vacuum':
+        if self.dynamics.clean_on_entry:
+            cleans = (i, j) != state[:2]
+        else:
+            cleans = action == 'vacuum'
+        if cleans:
             cell_type = self._grids[i][j]
-            cleaning_success_probability = 0
-            if cell_type == 'v':
-                cleaning_success_probability = 0.95
-            elif cell_type == 't':
-                cleaning_success_probability = 0.85
-            elif cell_type == 'T':
-                cleaning_success_probability = 0.75
+            cleaning_success_probability = self.dynamics.success_probability.get(cell_type, 0)
 
             cleanliness_list = list(cleanliness)
             cleanliness_list[i * self._n + j] = 'c'
@@ -73,55 +476,1083 @@ class MDP:
         """
         i, j, cleanliness = state
         i_next, j_next, cleanliness_next = next_state
+        rewards = self.dynamics.rewards
 
-        if action == 'vacuum':
+        if self.dynamics.clean_on_entry:
+            if state == next_state:
+                return rewards['bump']
+            elif cleanliness_next[i_next * self._n + j_next] == 'c' and cleanliness[i * self._n + j] != 'c':
+                return rewards['clean']
+            elif cleanliness_next[i_next * self._n + j_next] == 'c' and cleanliness[i * self._n + j] == 'c':
+                return rewards['move']
+            else:
+                return rewards['fail']
+        elif action == 'vacuum':
             if cleanliness[i * self._n + j] == 'c':
-                return -5
+                return rewards['idle']
             elif cleanliness[i * self._n + j] == 'd' and cleanliness_next[i_next * self._n + j_next] == 'c':
-                return 10
+                return rewards['clean']
             elif cleanliness[i * self._n + j] == 'd' and cleanliness_next[i_next * self._n + j_next] == 'd':
-                return -1
-        elif action in ['up', 'down', 'left', 'right']:
+                return rewards['fail']
+        elif action in MOVES:
             if state == next_state:
-                return -5
+                return rewards['bump']
             else:
-                return -1
+                return rewards['move']
 
         return 0
 
-    def value_iteration(self):
+    def solve(self, solver='value_iteration', **kwargs):
         """
+        Run one of the solvers in :data:`SOLVERS`. All of them start from the
+        current ``V``, stop once no value changes by ``theta`` or more, record
+        the number of single-state Bellman backups performed in ``backups`` and
+        pass a SweepStats to ``callback``, when set, after every sweep.
 
-        :return:
+        Their stopping rules only look at the values they compute, which for a
+        float32 ``V`` are rounded. After a float32 solve, and after the chunked
+        solver, which is meant for grids too large for the compiled model, one
+        more float64 pass measures the Bellman residual ``r`` of ``V``. ``V`` is
+        within ``r / (1 - gamma)`` of the exact fixed point, and
+        ``error_bound`` is set to the loss bound ``2 * gamma * r / (1 - gamma)``
+        of the policy.
+
+        :param solver: String, the solver name.
+        :param kwargs: Extra keyword arguments for the solver.
+        :return: Tuple of (value array, policy array of action codes, iteration count).
+        """
+        if solver not in SOLVERS:
+            raise ValueError(f"Unknown solver {solver!r}, expected one of {SOLVERS}")
+        v, policy, iterations = getattr(self, solver)(**kwargs)
+        if self.V.dtype != np.float64 or solver == 'chunked':
+            self.error_bound = 2 * self.gamma * self.bellman_residual(kwargs.get('chunk_size', 1 << 16)) / \
+                (1 - self.gamma)
+        return v, policy, iterations
+
+    def value_iteration(self, backend='numpy', workers=None, epsilon=None, stable_sweeps=None, max_sweeps=None,
+                        time_limit=None):
         """
+        Synchronous value iteration over the packed state space.
+
+        By default it stops once no value changes by ``theta`` or more. With
+        ``epsilon`` it instead stops once the returned policy is guaranteed to be
+        ``epsilon``-optimal: a sweep changing no value by more than ``delta``
+        bounds the loss of the greedy policy by ``2 * gamma * delta / (1 - gamma)``.
+        ``stable_sweeps``, ``max_sweeps`` and ``time_limit`` stop earlier still,
+        returning the greedy policy of the last sweep. ``stop_reason`` records
+        which rule fired and ``error_bound`` the guarantee reached.
+
+        :param backend: String, 'numpy' for the vectorised engine or 'loop' for the
+            per-state reference implementation. Both give the same results.
+        :param workers: Optional integer; with more than one worker the numpy
+            engine shards the states across a process pool, using at most one
+            worker per state.
+        :param epsilon: Optional float, the policy loss to guarantee instead of
+            stopping on ``theta``.
+        :param stable_sweeps: Optional integer, stop once the greedy policy has not
+            changed for this many sweeps.
+        :param max_sweeps: Optional integer, stop after this many sweeps.
+        :param time_limit: Optional float, stop after the sweep that exceeds this
+            many seconds.
+        :return: Tuple of (value array, policy array of action codes, iteration count).
+        """
+        stopping = {'epsilon': epsilon, 'stable_sweeps': stable_sweeps, 'max_sweeps': max_sweeps,
+                    'time_limit': time_limit, 'start_time': time.perf_counter()}
+        if backend == 'numpy':
+            if workers is not None and workers > 1:
+                # Every shard needs at least one state
+                workers = min(workers, self.state_num)
+            if workers is not None and workers > 1:
+                return self._value_iteration_parallel(workers, stopping)
+            return self._value_iteration_numpy(stopping)
+        elif backend == 'loop':
+            return self._value_iteration_loop(stopping)
+        raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+
+    def _stop_reason(self, stopping, iteration, delta, stable):
+        """
+        :param stopping: Dict of the stopping rules given to :meth:`value_iteration`.
+        :param iteration: Integer, number of sweeps done.
+        :param delta: Float, the largest value change of the last sweep.
+        :param stable: Integer, number of sweeps the greedy policy has not changed.
+        :return: String naming the rule that stops value iteration now, or None.
+        """
+        self.error_bound = 2 * self.gamma * float(delta) / (1 - self.gamma)
+        if stopping['epsilon'] is not None:
+            if self.error_bound < stopping['epsilon']:
+                return 'epsilon'
+        elif delta < self.theta:
+            return 'theta'
+        if stopping['stable_sweeps'] is not None and stable >= stopping['stable_sweeps']:
+            return 'stable_sweeps'
+        if stopping['max_sweeps'] is not None and iteration >= stopping['max_sweeps']:
+            return 'max_sweeps'
+        if stopping['time_limit'] is not None and time.perf_counter() - stopping['start_time'] >= \
+                stopping['time_limit']:
+            return 'time_limit'
+        return None
+
+    def _value_iteration_loop(self, stopping):
+        """
+        Reference value iteration: one Python backup per state through
+        :meth:`transition` and :meth:`reward`. When profiling, everything
+        outside those two calls counts as 'max'.
+
+        :return: Tuple of (value array, policy array of action codes, iteration count).
+        """
+        transition, reward = self.transition, self.reward
+        if self.profile:
+            self.timings = dict.fromkeys(PROFILE_PHASES, 0.0)
+            transition, reward = self._timed(transition, 'transition'), self._timed(reward, 'reward')
+        solve_start = time.perf_counter()
+
+        track = self.callback is not None or stopping['stable_sweeps'] is not None
+        stable = 0
+
         iteration_number = 0
-        policy = {}
+        self.backups = 0
+        policy = np.full(self.state_num, -1, dtype=np.int8)
         while True:
+            start_time = time.perf_counter()
+            previous = policy.copy() if track else None
             delta = 0
             V_copy = self.V.copy()
-            for state in self._states:
-                if state[:2] + (tuple(state[2]),) not in self._goalStates:
-                    v = self.V[state]
+            for index in range(self.state_num):
+                if not self.is_goal(index):
+                    state = self.decode(index)
+                    v = self.V[index]
                     best_action_val = float('-inf')
                     best_action = None
-                    for action in self._actions:
+                    for code, action in enumerate(self._actions):
                         val = 0
-                        transition_probs = self.transition(state, action)
+                        transition_probs = transition(state, action)
                         for next_state, prob in transition_probs.items():
-                            reward_val = self.reward(state, action, next_state)
-                            val += prob * (reward_val + self.gamma * self.V[next_state])
+                            reward_val = reward(state, action, next_state)
+                            val += prob * (reward_val + self.gamma * self.V[self.encode(next_state)])
                         if val > best_action_val:
                             best_action_val = val
-                            best_action = action
-                    V_copy[state] = best_action_val
-                    policy[state] = best_action
-                    delta = max(delta, abs(v - V_copy[state]))
+                            best_action = code
+                    V_copy[index] = best_action_val
+                    policy[index] = best_action
+                    delta = max(delta, abs(v - V_copy[index]))
+                    self.backups += 1
+            self.V = V_copy
+            iteration_number += 1
+            if track:
+                changes = (policy != previous).sum()
+                stable = stable + 1 if changes == 0 else 0
+            if self.callback is not None:
+                self._report_sweep(iteration_number, delta, start_time, int((policy >= 0).sum()), changes)
+            self.stop_reason = self._stop_reason(stopping, iteration_number, delta, stable)
+            if self.stop_reason is not None:
+                break
+        if self.profile:
+            self.timings['max'] = time.perf_counter() - solve_start - self.timings['transition'] - \
+                self.timings['reward']
+        return self.V, policy, iteration_number
+
+    def _timed(self, function, phase):
+        """
+        :return: ``function`` wrapped to add its run time to ``timings[phase]``.
+        """
+        def timed(*args):
+            start_time = time.perf_counter()
+            result = function(*args)
+            self.timings[phase] += time.perf_counter() - start_time
+            return result
+        return timed
+
+    def _report_sweep(self, iteration, delta, start_time, backups, policy_changes):
+        self.callback(SweepStats(iteration, float(delta), time.perf_counter() - start_time, int(backups),
+                                 int(policy_changes)))
+
+    @property
+    def model(self):
+        """
+        The compiled transition/reward tables of this grid, built on first use
+        and shared by every solver afterwards.
+
+        :return: CompiledModel.
+        """
+        if self._model is None:
+            self._model = self.compile()
+        return self._model
+
+    def compile(self):
+        """
+        Compile :meth:`transition` and :meth:`reward` into sparse tables over the
+        states of this model.
+
+        :return: CompiledModel.
+        """
+        states = self._packed_states()
+        index_type = np.int32 if self.state_num <= np.iinfo(np.int32).max else np.int64
+        counts, indices, probs, rewards = [], [], [], []
+        for action in self._actions:
+            row_counts, successors, row_probs, row_rewards = self._row_entries(states, action)
+            counts.append(row_counts)
+            indices.append(successors.astype(index_type))
+            probs.append(row_probs)
+            rewards.append(row_rewards)
+
+        indptr = np.zeros(len(self._actions) * self.state_num + 1, dtype=np.int64)
+        np.cumsum(np.concatenate(counts), out=indptr[1:])
+        goal = np.zeros(self.state_num, dtype=bool)
+        goal[self._goal_indices()] = True
+        return CompiledModel(list(self._actions), indptr, np.concatenate(indices), np.concatenate(probs),
+                             np.concatenate(rewards), goal)
+
+    def _row_entries(self, states, action):
+        """
+        The CSR entries :meth:`compile` stores for the rows of ``action``:
+        outcomes of probability 0 are dropped, except the first, which is always
+        kept so that no row is empty.
+
+        :param states: Array of packed state ids.
+        :param action: String, the action.
+        :return: Tuple of (number of entries per state, successor state indices,
+            probabilities, rewards), the entries listed row by row.
+        """
+        outcomes, outcome_probs, outcome_rewards = self._outcomes(states, action)
+        keep = outcome_probs > 0
+        keep[:, 0] = True
+        return keep.sum(axis=1), self._indices(outcomes[keep]), outcome_probs[keep], outcome_rewards[keep]
+
+    def _outcomes(self, states, action):
+        """
+        Vectorised :meth:`transition` and :meth:`reward` over packed states.
+
+        Every action has at most two outcomes, listed in the same order as
+        :meth:`transition`; unused second outcomes point back at the state with
+        probability 0. Cleaning an already clean cell keeps the quirk of
+        :meth:`transition`, where the two identical outcomes collapse onto the
+        failure probability.
+
+        :param states: Array of packed state ids.
+        :param action: String, the action.
+        :return: Tuple of (outcome ids, probabilities, rewards), each of shape (len(states), 2).
+        """
+        pos, mask = np.divmod(states, self._masks)
+        next_pos, next_mask, outcome_probs, outcome_rewards = transition_outcomes(self._grids, self.dynamics, pos,
+                                                                                  mask, action)
+        return next_pos * self._masks + next_mask, outcome_probs, outcome_rewards
+
+    def _value_iteration_numpy(self, stopping):
+        """
+        Vectorised value iteration: each sweep backs up every state under all
+        actions at once using the compiled model.
+        """
+        model = self.model
+        timings = None
+        if self.profile:
+            self.timings = timings = dict.fromkeys(PROFILE_PHASES, 0.0)
+        track = self.callback is not None or stopping['stable_sweeps'] is not None
+        previous = np.full(self.state_num, -1)
+        stable = 0
+        backups = self.state_num - len(self._goal_indices())
+
+        iteration_number = 0
+        self.backups = 0
+        while True:
+            start_time = time.perf_counter()
+            q = model.q_values(self.V, self.gamma, timings)
+            max_start = time.perf_counter()
+            V_copy = np.where(model.goal, self.V, q.max(axis=0)).astype(self.V.dtype, copy=False)
+            delta = np.abs(V_copy - self.V).max()
+            if timings is not None:
+                timings['max'] += time.perf_counter() - max_start
             self.V = V_copy
             iteration_number += 1
+            self.backups += backups
+            if track:
+                policy = np.where(model.goal, -1, q.argmax(axis=0))
+                changes = (policy != previous).sum()
+                stable = stable + 1 if changes == 0 else 0
+                previous = policy
+            if self.callback is not None:
+                self._report_sweep(iteration_number, delta, start_time, backups, changes)
+            self.stop_reason = self._stop_reason(stopping, iteration_number, delta, stable)
+            if self.stop_reason is not None:
+                break
+        policy = q.argmax(axis=0).astype(np.int8)
+        policy[model.goal] = -1
+        return self.V, policy, iteration_number
+
+    def _value_iteration_parallel(self, workers, stopping):
+        """
+        Vectorised value iteration with the states split into contiguous shards,
+        one task per shard and sweep. Values live in two shared buffers that swap
+        roles every sweep, so workers read the previous sweep and write the next
+        one without pickling ``V``. Collecting every shard's delta is the barrier
+        between sweeps. Each state is backed up exactly as in the serial engine,
+        so the results are bit-identical. Profiling is not supported here.
+        """
+        model = self.model
+        # The buffers hold the storage type of V, so every sweep is rounded as
+        # in the serial engine
+        dtype = self.V.dtype
+        buffers = [multiprocessing.RawArray('f' if dtype == np.float32 else 'd', self.state_num) for _ in range(2)]
+        np.frombuffer(buffers[0], dtype=dtype)[:] = self.V
+        policy_buffer = multiprocessing.RawArray('b', self.state_num)
+        bounds = np.linspace(0, self.state_num, workers + 1).astype(np.int64)
+        shards = list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+        track = self.callback is not None or stopping['stable_sweeps'] is not None
+        previous = np.full(self.state_num, -1)
+        stable = 0
+        backups = self.state_num - len(self._goal_indices())
+
+        iteration_number = 0
+        self.backups = 0
+        source = 0
+        with multiprocessing.Pool(workers, _init_shard_worker,
+                                  (model, self.gamma, buffers, dtype, policy_buffer, shards)) as pool:
+            while True:
+                start_time = time.perf_counter()
+                delta = max(pool.map(_sweep_shard, [(shard, source) for shard in range(len(shards))]))
+                source = 1 - source
+                iteration_number += 1
+                self.backups += backups
+                if track:
+                    policy = np.where(model.goal, -1, np.frombuffer(policy_buffer, dtype=np.int8))
+                    changes = (policy != previous).sum()
+                    stable = stable + 1 if changes == 0 else 0
+                    previous = policy
+                if self.callback is not None:
+                    self._report_sweep(iteration_number, delta, start_time, backups, changes)
+                self.stop_reason = self._stop_reason(stopping, iteration_number, delta, stable)
+                if self.stop_reason is not None:
+                    break
+        self.V = np.frombuffer(buffers[source], dtype=dtype).copy()
+        policy = np.frombuffer(policy_buffer, dtype=np.int8).copy()
+        policy[model.goal] = -1
+        return self.V, policy, iteration_number
+
+    def gauss_seidel(self, block_size=1 << 14):
+        """
+        In-place value iteration. Non-goal states are visited in order of
+        increasing number of dirty cells, then dirt mask, and backed up in blocks
+        of up to ``block_size`` states that never mix dirt counts, each block
+        already seeing the new values of the blocks before it. No action makes
+        a cell dirty, so a state only reaches states with as many dirty cells or
+        fewer, and values flow from the goal towards dirtier states within a
+        single sweep.
+
+        :param block_size: Integer, largest number of states backed up together.
+        :return: Tuple of (value array, policy array of action codes, iteration count).
+        """
+        model = self.model
+        policy = np.full(self.state_num, -1, dtype=np.int8)
+        self.backups = 0
+        states = np.flatnonzero(~model.goal)
+        if not len(states):
+            return self.V, policy, 0
+        packed = self._packed_states()[states]
+        dirt = self._dirt_counts(packed % self._masks)
+        sort = np.lexsort((packed // self._masks, packed % self._masks, dirt))
+        order, dirt = states[sort], dirt[sort]
+        blocks = [model.block(layer[start:start + block_size])
+                  for layer in np.split(order, np.flatnonzero(np.diff(dirt)) + 1)
+                  for start in range(0, len(layer), block_size)]
+
+        iteration_number = 0
+        while True:
+            start_time = time.perf_counter()
+            previous = policy.copy() if self.callback is not None else None
+            delta = 0
+            for block in blocks:
+                q = model.block_q_values(block, self.V, self.gamma)
+                new_values = q.max(axis=0)
+                delta = max(delta, np.abs(new_values - self.V[block.states]).max())
+                self.V[block.states] = new_values
+                policy[block.states] = q.argmax(axis=0)
+            iteration_number += 1
+            self.backups += len(order)
+            if self.callback is not None:
+                self._report_sweep(iteration_number, delta, start_time, len(order), (policy != previous).sum())
             if delta < self.theta:
                 break
         return self.V, policy, iteration_number
 
+    def prioritized_sweeping(self, threshold=0.2):
+        """
+        In-place backups ordered by Bellman errors.
+
+        Priorities start as the exact Bellman residuals. After a state's value
+        changes by ``d``, each predecessor reaching it with probability ``p`` gains
+        ``gamma * p * d``, which keeps every priority an upper bound on that
+        state's residual. Each step backs up together every state whose priority
+        is at least ``theta`` and ``threshold`` times the largest priority. Once
+        no priority reaches ``theta`` a full residual check confirms that no
+        value would change by ``theta`` or more. Every step counts as a sweep
+        for ``callback``.
+
+        :param threshold: Float in (0, 1], the fraction of the largest priority
+            a state needs to be backed up; near 1 only the largest errors are
+            backed up, giving more, smaller steps.
+        :return: Tuple of (value array, policy array of action codes, number of
+            backup steps).
+        """
+        model = self.model
+        _, pred_states, pred_probs = model.predecessors()
+        # Greedy action of each state at its last backup, for the callback
+        greedy = np.full(self.state_num, -1)
+
+        iteration_number = 0
+        self.backups = 0
+        while True:
+            q = model.q_values(self.V, self.gamma)
+            priority = np.where(model.goal, 0, np.abs(q.max(axis=0) - self.V))
+            if priority.max() < self.theta:
+                break
+
+            while True:
+                start_time = time.perf_counter()
+                largest = priority.max()
+                if largest < self.theta:
+                    break
+                states = np.flatnonzero(priority >= max(self.theta, threshold * largest))
+                priority[states] = 0
+                q_batch = model.block_q_values(model.block(states), self.V, self.gamma)
+                new_values = q_batch.max(axis=0)
+                change = np.abs(new_values - self.V[states])
+                self.V[states] = new_values
+                iteration_number += 1
+                self.backups += len(states)
+                if self.callback is not None:
+                    actions = q_batch.argmax(axis=0)
+                    self._report_sweep(iteration_number, change.max(), start_time, len(states),
+                                       (actions != greedy[states]).sum())
+                    greedy[states] = actions
+
+                entries, counts = model.predecessor_entries(states)
+                gains = self.gamma * pred_probs[entries] * np.repeat(change, counts)
+                priority += np.bincount(pred_states[entries], gains, minlength=self.state_num)
+                priority[model.goal] = 0
+
+        policy = q.argmax(axis=0).astype(np.int8)
+        policy[model.goal] = -1
+        return self.V, policy, iteration_number
+
+    def update_cell(self, i, j, cell_type):
+        """
+        Change the type of one cell and re-solve from the current ``V``.
+
+        Only the rows of states with the robot on the cell or next to it can
+        change, so the compiled model is patched in place and only those states
+        are backed up first. Every state whose value changes by ``theta`` or more
+        then has its predecessors backed up in the next round, until no value
+        changes by that much. A full residual check, as in
+        :meth:`prioritized_sweeping`, restarts from any state the rounds missed,
+        so the stopping rule is the same as for a cold solve.
+
+        :param i: Integer, the row of the cell.
+        :param j: Integer, the column of the cell.
+        :param cell_type: String, one of the cell types of the dynamics.
+        :return: Tuple of (value array, policy array of action codes, number of
+            rounds).
+        """
+        if cell_type not in self.dynamics.success_probability:
+            raise ValueError(f"Unknown cell type {cell_type!r}, expected one of "
+                             f"{tuple(self.dynamics.success_probability)}")
+        if not (0 <= i < self._m and 0 <= j < self._n):
+            raise IndexError(f"Cell ({i}, {j}) is outside the {self._m}x{self._n} grid")
+        if self._symmetries:
+            raise ValueError("update_cell needs a model built without symmetry, a new cell type can break it")
+        # Copy the rows so the caller's grid is left untouched
+        self._grids = [list(row) for row in self._grids]
+        self._grids[i][j] = cell_type
+
+        packed = self._packed_states()
+        pos = packed // self._masks
+        row, column = np.divmod(pos, self._n)
+        states = np.flatnonzero(np.abs(row - i) + np.abs(column - j) <= 1)
+        if self._model is not None:
+            # Success probabilities are strictly between 0 and 1 for every cell
+            # type, so the rows keep their outcomes and only the numbers change
+            for code, action in enumerate(self._actions):
+                _, _, probs, rewards = self._row_entries(packed[states], action)
+                block = self._model.block(states, np.full(len(states), code))
+                self._model.update_entries(block.entries, probs, rewards)
+        model = self.model
+        _, pred_states, _ = model.predecessors()
+        active = states[~model.goal[states]]
+        if self.callback is not None:
+            # Greedy action of each state before the change, for the callback
+            greedy = model.q_values(self.V, self.gamma).argmax(axis=0)
+
+        iteration_number = 0
+        self.backups = 0
+        while True:
+            while len(active):
+                start_time = time.perf_counter()
+                q = model.block_q_values(model.block(active), self.V, self.gamma)
+                new_values = q.max(axis=0)
+                change = np.abs(new_values - self.V[active])
+                changed = active[change >= self.theta]
+                self.V[active] = new_values
+                iteration_number += 1
+                self.backups += len(active)
+                if self.callback is not None:
+                    actions = q.argmax(axis=0)
+                    self._report_sweep(iteration_number, change.max(), start_time, len(active),
+                                       (actions != greedy[active]).sum())
+                    greedy[active] = actions
+
+                entries, _ = model.predecessor_entries(changed)
+                marked = np.zeros(self.state_num, dtype=bool)
+                marked[pred_states[entries]] = True
+                active = np.flatnonzero(marked & ~model.goal)
+            q = model.q_values(self.V, self.gamma)
+            residual = np.where(model.goal, 0, np.abs(q.max(axis=0) - self.V))
+            active = np.flatnonzero(residual >= self.theta)
+            if not len(active):
+                break
+        policy = q.argmax(axis=0).astype(np.int8)
+        policy[model.goal] = -1
+        return self.V, policy, iteration_number
+
+    def layered(self):
+        """
+        Value iteration one dirt layer at a time.
+
+        Transitions never make a cell dirty, so a state only reaches states with
+        the same dirt mask or with one fewer dirty cell. Layers of states with
+        1, 2, ... dirty cells are therefore solved in turn, each iterated to a
+        local fixed point (no value changing by ``theta`` or more) on top of the
+        already final values of the cleaner layers.
+
+        :return: Tuple of (value array, policy array of action codes, total number
+            of layer sweeps).
+        """
+        model = self.model
+        dirt = self._dirt_counts(self._packed_states() % self._masks)
+        order = np.argsort(dirt, kind='stable')
+        bounds = np.cumsum(np.bincount(dirt, minlength=self._cells + 1))
+        policy = np.full(self.state_num, -1, dtype=np.int8)
+
+        iteration_number = 0
+        self.backups = 0
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            if start == stop:
+                continue
+            states = order[start:stop]
+            block = model.block(states)
+            previous = np.full(len(states), -1)
+            while True:
+                start_time = time.perf_counter()
+                q = model.block_q_values(block, self.V, self.gamma)
+                new_values = q.max(axis=0)
+                delta = np.abs(new_values - self.V[states]).max()
+                self.V[states] = new_values
+                iteration_number += 1
+                self.backups += len(states)
+                if self.callback is not None:
+                    actions = q.argmax(axis=0)
+                    self._report_sweep(iteration_number, delta, start_time, len(states), (actions != previous).sum())
+                    previous = actions
+                if delta < self.theta:
+                    break
+            policy[states] = q.argmax(axis=0)
+        return self.V, policy, iteration_number
+
+    def chunked(self, chunk_size=1 << 16, in_place=True):
+        """
+        Matrix-free value iteration for grids too large to compile. Each sweep
+        walks the states in chunks of ``chunk_size``, building their transitions
+        on the fly with :meth:`_outcomes`, so working memory is bounded by the
+        chunk instead of growing with the state space.
+
+        In place, each chunk already sees the values written by the chunks before
+        it and no second copy of ``V`` exists. Otherwise every chunk reads the
+        previous sweep, as in :meth:`value_iteration`, whose float64 results it
+        then reproduces exactly. Run through :meth:`solve`, ``error_bound`` is
+        then set from the Bellman residual of ``V``.
+
+        :param chunk_size: Integer, number of states backed up together.
+        :param in_place: Boolean, update ``V`` in place instead of from a copy.
+        :return: Tuple of (value array, policy array of action codes, iteration count).
+        """
+        policy = np.full(self.state_num, -1, dtype=np.int8)
+        chunks = [(start, min(start + chunk_size, self.state_num)) for start in range(0, self.state_num, chunk_size)]
+
+        iteration_number = 0
+        self.backups = 0
+        while True:
+            start_time = time.perf_counter()
+            previous = policy.copy() if self.callback is not None else None
+            source = self.V if in_place else self.V.copy()
+            delta = 0
+            backups = 0
+            for start, stop in chunks:
+                q, goal = self._chunk_q_values(start, stop, source)
+                new_values = np.where(goal, self.V[start:stop], q.max(axis=0))
+                delta = max(delta, np.abs(new_values - self.V[start:stop]).max())
+                self.V[start:stop] = new_values
+                policy[start:stop] = np.where(goal, -1, q.argmax(axis=0))
+                backups += len(goal) - int(goal.sum())
+            iteration_number += 1
+            self.backups += backups
+            if self.callback is not None:
+                self._report_sweep(iteration_number, delta, start_time, backups, (policy != previous).sum())
+            if delta < self.theta:
+                break
+        return self.V, policy, iteration_number
+
+    def bellman_residual(self, chunk_size=1 << 16):
+        """
+        :param chunk_size: Integer, number of states evaluated together.
+        :return: Float, the largest change one float64 backup would make to ``V``.
+        """
+        residual = 0.0
+        for start in range(0, self.state_num, chunk_size):
+            stop = min(start + chunk_size, self.state_num)
+            q, goal = self._chunk_q_values(start, stop, self.V)
+            change = np.where(goal, 0, np.abs(q.max(axis=0) - self.V[start:stop]))
+            residual = max(residual, float(change.max()))
+        return residual
+
+    def _chunk_q_values(self, start, stop, v):
+        """
+        Action values of the states ``start`` to ``stop`` without the compiled
+        model, computed entirely in float64. Unused second outcomes have
+        probability 0 and add exactly 0, so for a float64 ``v`` the result
+        matches :meth:`CompiledModel.q_values`.
+
+        :return: Tuple of (array of shape (actions, stop - start), goal flags).
+        """
+        states = self._packed_states()[start:stop] if self._states is not None else np.arange(start, stop)
+        q = np.empty((len(self._actions), stop - start))
+        for code, action in enumerate(self._actions):
+            outcomes, outcome_probs, outcome_rewards = self._outcomes(states, action)
+            outcomes = self._indices(outcomes.ravel()).reshape(outcomes.shape)
+            successor_values = v[outcomes].astype(np.float64, copy=False)
+            q[code] = outcome_probs[:, 0] * (outcome_rewards[:, 0] + self.gamma * successor_values[:, 0]) + \
+                outcome_probs[:, 1] * (outcome_rewards[:, 1] + self.gamma * successor_values[:, 1])
+        return q, states % self._masks == 0
+
+    def _dirt_counts(self, masks):
+        """
+        :param masks: Array of dirt masks.
+        :return: Array with the number of dirty cells of each mask.
+        """
+        counts = np.zeros(len(masks), dtype=np.int64)
+        for bit in range(self._cells):
+            counts += (masks >> bit) & 1
+        return counts
+
+    def policy_iteration(self, evaluation=None):
+        """
+        Howard's policy iteration, starting from the greedy policy of the current
+        ``V``. Stops when no state's action can be improved, at which point ``V``
+        is the exact value of the returned policy.
+
+        :param evaluation: String, 'direct' to solve the policy's linear system with
+            a sparse LU factorisation or 'iterative' to sweep it until no value
+            changes by ``theta`` or more. Defaults to 'direct' when scipy is
+            installed.
+        :return: Tuple of (value array, policy array of action codes, number of
+            policy improvements).
+        """
+        if evaluation is None:
+            evaluation = 'iterative' if sparse is None else 'direct'
+        if evaluation not in EVALUATIONS:
+            raise ValueError(f"Unknown evaluation {evaluation!r}, expected one of {EVALUATIONS}")
+        if evaluation == 'direct' and sparse is None:
+            raise ImportError("Direct policy evaluation requires scipy")
+        model = self.model
+        states = np.flatnonzero(~model.goal)
+        policy = model.q_values(self.V, self.gamma).argmax(axis=0)
+
+        iteration_number = 0
+        self.backups = 0
+        while True:
+            start_time = time.perf_counter()
+            backups = self.backups
+            values = self.V[states].copy() if self.callback is not None else None
+            if evaluation == 'direct':
+                self._solve_policy(states, policy[states])
+            else:
+                self._sweep_policy(states, policy[states], None)
+            q = model.q_values(self.V, self.gamma)
+            iteration_number += 1
+            self.backups += len(states)
+
+            # Only switch action on a strict improvement so ties cannot cycle
+            best = q[:, states].argmax(axis=0)
+            improved = q[best, states] > q[policy[states], states] + 1e-9 * np.abs(q[best, states])
+            if self.callback is not None:
+                self._report_sweep(iteration_number, np.abs(self.V[states] - values).max(), start_time,
+                                   self.backups - backups, improved.sum())
+            if not improved.any():
+                break
+            policy[states[improved]] = best[improved]
+
+        policy = policy.astype(np.int8)
+        policy[model.goal] = -1
+        return self.V, policy, iteration_number
+
+    def modified_policy_iteration(self, eval_sweeps=5):
+        """
+        Value iteration where each greedy sweep is followed by ``eval_sweeps``
+        cheaper sweeps that only back up the greedy action. With ``eval_sweeps=0``
+        this is plain value iteration.
+
+        :param eval_sweeps: Integer, number of partial evaluation sweeps per improvement.
+        :return: Tuple of (value array, policy array of action codes, number of
+            improvement sweeps).
+        """
+        model = self.model
+        states = np.flatnonzero(~model.goal)
+
+        previous = np.full(self.state_num, -1)
+
+        iteration_number = 0
+        self.backups = 0
+        while True:
+            start_time = time.perf_counter()
+            backups = self.backups
+            q = model.q_values(self.V, self.gamma)
+            V_copy = np.where(model.goal, self.V, q.max(axis=0)).astype(self.V.dtype, copy=False)
+            delta = np.abs(V_copy - self.V).max()
+            self.V = V_copy
+            iteration_number += 1
+            self.backups += len(states)
+            policy = np.where(model.goal, -1, q.argmax(axis=0))
+            if delta >= self.theta:
+                self._sweep_policy(states, policy[states], eval_sweeps)
+            if self.callback is not None:
+                self._report_sweep(iteration_number, delta, start_time, self.backups - backups,
+                                   (policy != previous).sum())
+                previous = policy
+            if delta < self.theta:
+                break
+        policy = q.argmax(axis=0).astype(np.int8)
+        policy[model.goal] = -1
+        return self.V, policy, iteration_number
+
+    def evaluate_policy(self, policy):
+        """
+        Value of following a fixed policy, e.g. one found without this model,
+        evaluated from ``V`` until no value changes by ``theta`` or more.
+
+        :param policy: Array of action codes indexed by state, -1 for goal states.
+        :return: Value array.
+        """
+        policy = np.asarray(policy)
+        states = np.flatnonzero(policy >= 0)
+        self._sweep_policy(states, policy[states], None)
+        return self.V
+
+    def _sweep_policy(self, states, actions, sweeps):
+        """
+        Iterative policy evaluation: back up ``states`` under their fixed
+        ``actions`` for ``sweeps`` sweeps, or until no value changes by ``theta``
+        or more when ``sweeps`` is None.
+        """
+        block = self.model.block(states, actions)
+        sweep = 0
+        while sweeps is None or sweep < sweeps:
+            new_values = self.model.block_q_values(block, self.V, self.gamma)[0]
+            delta = np.abs(new_values - self.V[states]).max()
+            self.V[states] = new_values
+            sweep += 1
+            self.backups += len(states)
+            if sweeps is None and delta < self.theta:
+                break
+
+    def _solve_policy(self, states, actions):
+        """
+        Direct policy evaluation: solve ``(I - gamma P) v = r`` over the non-goal
+        ``states``, with goal states entering the right-hand side as constants.
+        """
+        model = self.model
+        block = model.block(states, actions)
+        counts = np.diff(np.append(block.starts, len(block.entries)))
+        rows = np.repeat(np.arange(len(states)), counts)
+        successors = model.indices[block.entries]
+        probs = model.probs[block.entries]
+        r = np.add.reduceat(probs * model.rewards[block.entries], block.starts)
+
+        local = np.full(self.state_num, -1, dtype=np.int64)
+        local[states] = np.arange(len(states))
+        inside = local[successors] >= 0
+        np.add.at(r, rows[~inside], self.gamma * probs[~inside] * self.V[successors[~inside]])
+        transitions = sparse.csr_matrix((probs[inside], (rows[inside], local[successors[inside]])),
+                                        shape=(len(states), len(states)))
+        self.V[states] = spsolve((sparse.identity(len(states), format='csr') - self.gamma * transitions).tocsc(), r)
+
+
+class StringStateMDP(MDP):
+    """
+    An MDP whose states are named by strings such as 'm0n1cdd' (robot at row 0,
+    column 1, cells clean/dirty/dirty) outside the solver. Names are accepted
+    wherever a state is expected, are parsed without regular expressions, and
+    are only built when results are written out or expanded with
+    :meth:`as_dicts`: each name joins the 'm<i>n<j>' prefix of its robot
+    position to the cleanliness string of its mask, see
+    solution_file.unpack_masks. The names are not interned; each one is a new
+    string.
+    """
+
+    def _pack(self, state):
+        if isinstance(state, str):
+            state = parse_state_string(state)
+        return super()._pack(state)
+
+    def state_key(self, state):
+        return format_state_string(state)
+
+    def state_keys(self, start=0, stop=None):
+        positions = ['m' + str(i) + 'n' + str(j) for i in range(self._m) for j in range(self._n)]
+        stop = self.state_num if stop is None else stop
+        packed = self._packed_states()[start:stop] if self._states is not None else np.arange(start, stop)
+        pos, mask = np.divmod(packed, self._masks)
+        return [positions[p] + cleanliness
+                for p, cleanliness in zip(pos.tolist(), unpack_masks(mask, self._cells, strings=True))]
+
+
+# Per-process state of the value iteration pool workers
+_shard_worker = {}
+
+
+def _init_shard_worker(model, gamma, buffers, dtype, policy_buffer, shards):
+    _shard_worker.update(model=model, gamma=gamma, shards=shards, rows={},
+                         values=[np.frombuffer(buffer, dtype=dtype) for buffer in buffers],
+                         policy=np.frombuffer(policy_buffer, dtype=np.int8))
+
+
+def _sweep_shard(task):
+    """
+    Back up one shard of states from the ``source`` value buffer into the other.
+
+    :param task: Tuple of (shard number, source buffer number).
+    :return: Float, the largest value change in the shard.
+    """
+    shard, source = task
+    model = _shard_worker['model']
+    start, stop = _shard_worker['shards'][shard]
+    if shard not in _shard_worker['rows']:
+        # Copy the shard's rows out once so sweeps read them contiguously
+        block = model.block(np.arange(start, stop))
+        _shard_worker['rows'][shard] = (model.probs[block.entries], model.rewards[block.entries],
+                                          model.indices[block.entries], block.starts)
+    probs, rewards, indices, starts = _shard_worker['rows'][shard]
+    v = _shard_worker['values'][source]
+    v_new = _shard_worker['values'][1 - source]
+
+    weighted = probs * (rewards + _shard_worker['gamma'] * v[indices])
+    q = np.add.reduceat(weighted, starts).reshape(len(model.actions), stop - start)
+    v_new[start:stop] = np.where(model.goal[start:stop], v[start:stop], q.max(axis=0))
+    _shard_worker['policy'][start:stop] = q.argmax(axis=0)
+    return np.abs(v_new[start:stop] - v[start:stop]).max()
+
+
+class CompiledModel:
+    """
+    Sparse transition/reward tables of an MDP, built once per grid.
+
+    Rows are (action, state) pairs flattened as ``action * state_num + state``,
+    stored CSR-style: ``indices[indptr[r]:indptr[r + 1]]`` are the successors of
+    row ``r``, and ``probs`` and ``rewards`` hold the probability and immediate
+    reward of each of them.
+    """
+
+    def __init__(self, actions, indptr, indices, probs, rewards, goal):
+        self.actions = actions
+        self.indptr = indptr
+        self.indices = indices
+        self.probs = probs
+        self.rewards = rewards
+        self.goal = goal
+        self._starts = indptr[:-1]
+        self._predecessors = None
+
+    def update_entries(self, entries, probs, rewards):
+        """
+        Overwrite the probability and reward of some CSR entries in place.
+
+        :param entries: Array of entry positions.
+        :param probs: Array of new probabilities.
+        :param rewards: Array of new rewards.
+        """
+        self.probs[entries] = probs
+        self.rewards[entries] = rewards
+        self._predecessors = None
+
+    @property
+    def state_num(self):
+        return len(self.goal)
+
+    @property
+    def expected_rewards(self):
+        """
+        :return: Array of shape (actions, states), the expected immediate reward.
+        """
+        return self._row_sum(self.probs * self.rewards)
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.probs.nbytes + self.rewards.nbytes + self.goal.nbytes
+
+    def successors(self, action, state):
+        """
+        :param action: Integer, the action code.
+        :param state: Integer, the state index.
+        :return: Tuple of (successor indices, probabilities, rewards).
+        """
+        row = action * self.state_num + state
+        start, stop = self.indptr[row], self.indptr[row + 1]
+        return self.indices[start:stop], self.probs[start:stop], self.rewards[start:stop]
+
+    def q_values(self, v, gamma, timings=None):
+        """
+        Outcomes are summed in :meth:`MDP.transition` order, so the result is
+        bit-identical to the per-state reference loop.
+
+        :param v: Array of values indexed by state.
+        :param gamma: Float, the discount factor.
+        :param timings: Optional dict; the seconds spent gathering successor
+            values are added to its 'transition' entry and those spent weighting
+            rewards and summing outcomes to its 'reward' entry.
+        :return: Array of shape (actions, states), the action values under ``v``.
+        """
+        if timings is None:
+            return self._row_sum(self.probs * (self.rewards + gamma * v[self.indices]))
+        start_time = time.perf_counter()
+        successor_values = v[self.indices]
+        gathered = time.perf_counter()
+        q = self._row_sum(self.probs * (self.rewards + gamma * successor_values))
+        timings['transition'] += gathered - start_time
+        timings['reward'] += time.perf_counter() - gathered
+        return q
+
+    def block(self, states, actions=None):
+        """
+        Gather the CSR entries of the rows of ``states`` once, so the block can be
+        backed up repeatedly with :meth:`block_q_values`.
+
+        :param states: Array of state indices.
+        :param actions: Optional array with one action code per state, to gather
+            only the rows of a fixed policy instead of every action.
+        :return: StateBlock.
+        """
+        states = np.asarray(states, dtype=np.int64)
+        if actions is None:
+            rows = (np.arange(len(self.actions))[:, None] * self.state_num + states).ravel()
+        else:
+            rows = np.asarray(actions, dtype=np.int64) * self.state_num + states
+        entries, counts = _csr_entries(self.indptr, rows)
+        return StateBlock(states, entries, np.cumsum(counts) - counts)
+
+    def block_q_values(self, block, v, gamma):
+        """
+        :param block: StateBlock.
+        :param v: Array of values indexed by state.
+        :param gamma: Float, the discount factor.
+        :return: Array of shape (actions, len(block.states)), the action values under
+            ``v``, or (1, len(block.states)) for a block gathered for a fixed policy.
+        """
+        entries = block.entries
+        weighted = self.probs[entries] * (self.rewards[entries] + gamma * v[self.indices[entries]])
+        return np.add.reduceat(weighted, block.starts).reshape(-1, len(block.states))
+
+    def predecessors(self):
+        """
+        Transposed transition index, built on first use:
+        ``pred_states[pred_indptr[s]:pred_indptr[s + 1]]`` are the states with an
+        action reaching ``s``, and ``pred_probs`` the probability of doing so.
+
+        :return: Tuple of (pred_indptr, pred_states, pred_probs).
+        """
+        if self._predecessors is None:
+            sources = np.repeat(np.arange(len(self.indptr) - 1) % self.state_num, np.diff(self.indptr))
+            order = np.argsort(self.indices, kind='stable')
+            pred_indptr = np.zeros(self.state_num + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=self.state_num), out=pred_indptr[1:])
+            self._predecessors = pred_indptr, sources[order], self.probs[order]
+        return self._predecessors
+
+    def predecessor_entries(self, states):
+        """
+        :param states: Array of state indices.
+        :return: Tuple of (positions in the :meth:`predecessors` arrays of the
+            predecessors of every state in turn, number of them per state).
+        """
+        return _csr_entries(self.predecessors()[0], states)
+
+    def _row_sum(self, entries):
+        return np.add.reduceat(entries, self._starts).reshape(len(self.actions), self.state_num)
+
+
+def _csr_entries(indptr, rows):
+    """
+    :param indptr: Array of CSR row offsets.
+    :param rows: Array of row indices.
+    :return: Tuple of (positions of the entries of every row in turn, number of
+        entries per row).
+    """
+    starts = indptr[rows]
+    counts = indptr[rows + 1] - starts
+    return np.repeat(starts - (np.cumsum(counts) - counts), counts) + np.arange(counts.sum()), counts
+
+
+def transition_outcomes(grids, dynamics, pos, mask, action):
+    """
+    The transition and reward rules of ``dynamics`` over arrays of robot
+    positions and dirt masks, shared by MDP and by the solvers that never
+    enumerate the state space. Masks may be int64 or, for grids of up to
+    MAX_CELLS cells, uint64.
+
+    :param grids: List of Lists, the grid configuration.
+    :param dynamics: Dynamics, the action set and transition/reward rules.
+    :param pos: Array of robot positions ``i * n + j``.
+    :param mask: Array of dirt masks, bit ``m*n - 1 - k`` set when cell ``k`` is dirty.
+    :param action: String, the action.
+    :return: Tuple of (next positions, next masks, probabilities, rewards), each
+        of shape (len(pos), 2), the outcomes listed as in MDP.transition.
+    """
+    m, n = len(grids), len(grids[0])
+    cells = m * n
+    one = mask.dtype.type(1)
+    rewards = {kind: float(reward) for kind, reward in dynamics.rewards.items()}
+    cell_probs = np.array([dynamics.success_probability.get(cell_type, 0) for row in grids for cell_type in row])
+    if action == 'vacuum':
+        bit = np.left_shift(one, (cells - 1 - pos).astype(mask.dtype))
+        dirty = (mask & bit) != 0
+        p = cell_probs[pos]
+        outcomes = np.stack([pos, pos], axis=1), np.stack([np.where(dirty, mask & ~bit, mask), mask], axis=1)
+        outcome_probs = np.stack([np.where(dirty, p, 1 - p), np.where(dirty, 1 - p, 0)], axis=1)
+        outcome_rewards = np.stack([np.where(dirty, rewards['clean'], rewards['idle']),
+                                    np.where(dirty, rewards['fail'], 0.0)], axis=1)
+        return outcomes + (outcome_probs, outcome_rewards)
+
+    i, j = np.divmod(pos, n)
+    if action == 'up':
+        i = np.maximum(i - 1, 0)
+    elif action == 'down':
+        i = np.minimum(i + 1, m - 1)
+    elif action == 'left':
+        j = np.maximum(j - 1, 0)
+    elif action == 'right':
+        j = np.minimum(j + 1, n - 1)
+    next_pos = i * n + j
+    stayed = next_pos == pos
+    if not dynamics.clean_on_entry:
+        outcome_probs = np.stack([np.ones(len(pos)), np.zeros(len(pos))], axis=1)
+        outcome_rewards = np.stack([np.where(stayed, rewards['bump'], rewards['move']), np.zeros(len(pos))], axis=1)
+        return np.stack([next_pos, pos], axis=1), np.stack([mask, mask], axis=1), outcome_probs, outcome_rewards
+
+    bit = np.left_shift(one, (cells - 1 - next_pos).astype(mask.dtype))
+    cleans = ((mask & bit) != 0) & ~stayed
+    source_dirty = (mask & np.left_shift(one, (cells - 1 - pos).astype(mask.dtype))) != 0
+    p = cell_probs[next_pos]
+    outcome_probs = np.stack([np.where(stayed, 1.0, np.where(cleans, p, 1 - p)), np.where(cleans, 1 - p, 0)], axis=1)
+    outcome_rewards = np.stack([np.where(stayed, rewards['bump'],
+                                         np.where(source_dirty, rewards['clean'], rewards['move'])),
+                                np.where(cleans, rewards['fail'], 0.0)], axis=1)
+    return (np.stack([next_pos, next_pos], axis=1), np.stack([np.where(cleans, mask & ~bit, mask), mask], axis=1),
+            outcome_probs, outcome_rewards)
+
 
 def read_grid_from_file(filename):
     """
@@ -153,11 +1584,64 @@ def save_solution_to_file(filename, v, policy):
             f.write(f"{key} {policy[key]}\n")
 
 
+def save_solution_stream(filename, mdp, v, policy, compression=None, sections=True, chunk_size=1 << 16):
+    """
+    Save array results in the format of :func:`save_solution_to_file` without
+    expanding them into dictionaries first: keys are built and written one block
+    of ``chunk_size`` states at a time.
+
+    :param filename: String, name of the file.
+    :param mdp: MDP, the solved model.
+    :param v: Array of values indexed by state.
+    :param policy: Array of action codes indexed by state, -1 for goal states.
+    :param compression: Optional string, a key of solution_file.COMPRESSIONS.
+    :param sections: Boolean, whether to write the 'value' and 'policy' lines.
+    :param chunk_size: Integer, number of states per block.
+    :return: None
+    """
+    write_text_solution(filename, lambda: mdp.solution_blocks(v, policy, chunk_size), compression, sections)
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        input_filename = "test/test_case_1"
-    else:
-        input_filename = "test/" + sys.argv[1]
+    parser = argparse.ArgumentParser(description="Solve a vacuum-world grid with value iteration.")
+    parser.add_argument("test_case", nargs="?", default="test_case_1",
+                        help="name of a test case in the test folder, e.g. test_case_3")
+    parser.add_argument("--backend", choices=BACKENDS, default="numpy",
+                        help="value iteration engine to use")
+    parser.add_argument("--solver", choices=SOLVERS, default="value_iteration",
+                        help="algorithm used to solve the MDP")
+    parser.add_argument("--dynamics", choices=sorted(DYNAMICS), default="vacuum",
+                        help="'vacuum' cleans with a vacuum action, 'auto_clean' cleans every cell moved into")
+    parser.add_argument("--workers", type=int,
+                        help="number of processes for the numpy value iteration backend")
+    parser.add_argument("--dtype", choices=VALUE_DTYPES, default="float64",
+                        help="storage type of the value function; float32 halves its memory")
+    parser.add_argument("--chunk-size", type=int, default=1 << 16,
+                        help="chunked solver: number of states backed up together")
+    parser.add_argument("--epsilon", type=float,
+                        help="value iteration: stop once the policy is guaranteed epsilon-optimal instead of on theta")
+    parser.add_argument("--stable-sweeps", type=int,
+                        help="value iteration: stop once the policy has not changed for this many sweeps")
+    parser.add_argument("--max-sweeps", type=int, help="value iteration: stop after this many sweeps")
+    parser.add_argument("--time-limit", type=float, help="value iteration: stop after this many seconds")
+    parser.add_argument("--profile", action="store_true",
+                        help="print every sweep and, for value iteration, the time spent per backup phase")
+    parser.add_argument("--cache", nargs="?", const=DEFAULT_CACHE_DIR,
+                        help=f"reuse and store solutions in this folder (default {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--format", choices=("text", "binary"), default="text",
+                        help="write the solution as text or as a binary file (solution_N.bin)")
+    parser.add_argument("--compress", choices=sorted(COMPRESSIONS),
+                        help="compress the text solution, adding the matching suffix to its name")
+    parser.add_argument("--symmetry", action="store_true",
+                        help="solve only one state of every set that mirror images / rotations of the grid map "
+                             "onto each other, then expand the solution")
+    parser.add_argument("--start", nargs=3, action="append", metavar=("I", "J", "CLEANLINESS"),
+                        help="only solve the states reachable from this state, e.g. --start 0 0 dcdd; "
+                             "may be given several times")
+    args = parser.parse_args()
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    input_filename = "test/" + args.test_case
 
     # Extract the test case number and create the output filename
     test_case_num = input_filename.split("_")[-1]  # Get the number after "test_case_"
@@ -166,8 +1650,42 @@ if __name__ == "__main__":
     grids = read_grid_from_file(input_filename)
     for row in grids:
         print(row)
-    mdp = MDP(grids)
-    v, policy, iteration = mdp.value_iteration()
+    start_states = None
+    if args.start:
+        start_states = [(int(i), int(j), tuple(cleanliness)) for i, j, cleanliness in args.start]
+    mdp = MDP(grids, start_states, DYNAMICS[args.dynamics], args.dtype, args.symmetry)
+    if args.symmetry:
+        print(f"symmetries: {', '.join(mdp.symmetries) or 'none'}, {mdp.state_num} states solved")
+    if args.profile:
+        mdp.profile = True
+        mdp.callback = lambda stats: print(f"sweep {stats.iteration}: delta {stats.delta:.6g}, "
+                                           f"{stats.time * 1000:.2f} ms, {stats.backups} backups, "
+                                           f"{stats.policy_changes} policy changes")
+    options = {}
+    if args.solver == 'value_iteration':
+        options = {'backend': args.backend, 'workers': args.workers, 'epsilon': args.epsilon,
+                   'stable_sweeps': args.stable_sweeps, 'max_sweeps': args.max_sweeps, 'time_limit': args.time_limit}
+    elif args.solver == 'chunked':
+        options = {'chunk_size': args.chunk_size}
+    if args.cache:
+        v, policy, iteration = SolutionCache(args.cache).solve(mdp, args.solver, **options)
+    else:
+        v, policy, iteration = mdp.solve(args.solver, **options)
 
-    print(len(policy))
-    save_solution_to_file(output_filename, v, policy)
\ No newline at end of file
+    # The solution files describe every state, not only the ones solved
+    output_mdp = mdp
+    if args.symmetry:
+        output_mdp = MDP(grids, start_states, DYNAMICS[args.dynamics], args.dtype)
+        v, policy = mdp.expand(v, policy, output_mdp.reachable_states)
+
+    print(int((policy >= 0).sum()))
+    if args.dtype == 'float32' and mdp.error_bound is not None:
+        print(f"policy loss bound from the float64 Bellman residual: {mdp.error_bound:.4g}")
+    if args.profile and args.solver == 'value_iteration':
+        print(", ".join(f"{phase} {seconds:.4f} s" for phase, seconds in mdp.timings.items()))
+    if args.format == "binary":
+        save_binary_solution(output_filename + ".bin", output_mdp, v, policy, args.dtype, solver=args.solver)
+    else:
+        if args.compress:
+            output_filename += COMPRESSIONS[args.compress]
+        save_solution_stream(output_filename, output_mdp, v, policy, args.compress)